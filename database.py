@@ -1,77 +1,459 @@
+import json
 import sqlite3
+import threading
+import uuid
 from contextlib import contextmanager
 
 db_name = 'chatbot_roles.db'
+conversations_db_name = 'chatbot_conversations.db'
+transcriptions_db_name = 'transcription_jobs.db'
+videos_db_name = 'video_jobs.db'
+
+# Eine gemeinsame Verbindung pro Datenbank für den ganzen Prozess (Streamlit startet jeden Rerun in
+# einem neuen Thread), Zugriffe werden über eine Sperre pro Datenbank serialisiert
+connections = {}
+connections_lock = threading.Lock()
+
+# Prozessweiter Cache für Rollen, wird von insert_role, update_role und delete_role geleert
+role_cache = {}
+role_names_cache = None
+role_cache_lock = threading.Lock()
+
+# Bereits eingerichtete Datenbanken, Migrationen laufen nur einmal pro Prozess statt bei jedem Rerun
+initialized_databases = set()
+setup_lock = threading.Lock()
+
+def get_connection(db_name):
+    with connections_lock:
+        entry = connections.get(db_name)
+        if entry is None:
+            conn = sqlite3.connect(db_name, check_same_thread=False)
+            # WAL erlaubt gleichzeitiges Lesen während geschrieben wird
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            entry = connections[db_name] = (conn, threading.RLock())
+        return entry
 
 @contextmanager
 def connect_db(db_name):
-    conn = sqlite3.connect(db_name, check_same_thread=False)
-    c = conn.cursor()
-    try:
-        yield c
-    finally:
-        conn.commit()
-        conn.close()
+    conn, lock = get_connection(db_name)
+    with lock:
+        c = conn.cursor()
+        try:
+            yield c
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            c.close()
+
+def invalidate_role_cache():
+    global role_names_cache
+    with role_cache_lock:
+        role_cache.clear()
+        role_names_cache = None
+
+MAX_DESCRIPTION_LENGTH = 200000
+# Länge der Vorschau, die in Listen statt der vollständigen Beschreibung geladen wird
+PREVIEW_LENGTH = 200
 
 def validate_input(name, description, ai_model):
     if not (isinstance(name, str) and isinstance(description, str) and isinstance(ai_model, str)):
         raise ValueError("Alle Eingaben müssen vom Typ str sein")
-    if not (0 < len(name) <= 100 and 0 < len(description) <= 300 and 0 < len(ai_model) <= 100):
+    if not (0 < len(name) <= 100 and 0 < len(description) <= MAX_DESCRIPTION_LENGTH and 0 < len(ai_model) <= 100):
         raise ValueError("Eingaben überschreiten zulässige Längenbeschränkungen")
 
-def setup_database(db_name):
-    # Verbindung zur Datenbank herstellen
-    with connect_db(db_name) as c:
+def make_preview(description):
+    return description[:PREVIEW_LENGTH]
 
+def migration_create_roles(c):
     # Tabelle für Chatbot-Rollen erstellen, falls sie nicht existiert
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS roles (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT NOT NULL,
-            ai_model TEXT NOT NULL
-        )
-        ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS roles (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT NOT NULL,
+        ai_model TEXT NOT NULL
+    )
+    ''')
+
+def migration_unique_name_and_preview(c):
+    # Doppelte Rollennamen umbenennen (die älteste Rolle behält den Namen, weitere erhalten " (2)", " (3)", ...),
+    # danach eindeutigen Index anlegen
+    c.execute('SELECT id, name FROM roles WHERE id NOT IN (SELECT MIN(id) FROM roles GROUP BY name) ORDER BY id')
+    duplicates = c.fetchall()
+    if duplicates:
+        c.execute('SELECT name FROM roles')
+        taken = {row[0] for row in c.fetchall()}
+        for role_id, name in duplicates:
+            suffix = 2
+            while f"{name} ({suffix})" in taken:
+                suffix += 1
+            taken.add(f"{name} ({suffix})")
+            c.execute('UPDATE roles SET name = ? WHERE id = ?', (f"{name} ({suffix})", role_id))
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_name ON roles (name)')
+    c.execute("ALTER TABLE roles ADD COLUMN preview TEXT NOT NULL DEFAULT ''")
+    c.execute('UPDATE roles SET preview = substr(description, 1, ?)', (PREVIEW_LENGTH,))
+
+# Migrationen werden der Reihe nach ausgeführt, der Stand steht in PRAGMA user_version
+MIGRATIONS = [
+    migration_create_roles,
+    migration_unique_name_and_preview,
+]
+
+def migrate(db_name):
+    with connect_db(db_name) as c:
+        c.execute('PRAGMA user_version')
+        version = c.fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with connect_db(db_name) as c:
+            # sqlite3 führt DDL ohne offene Transaktion sofort aus; mit explizitem BEGIN werden Migration
+            # und neue Versionsnummer gemeinsam geschrieben oder bei einem Fehler gemeinsam verworfen
+            c.execute('BEGIN')
+            migration(c)
+            c.execute(f'PRAGMA user_version = {number}')
+
+def run_once(key, setup, db_name):
+    # Führt eine Einrichtung pro Datenbank nur beim ersten Aufruf im Prozess aus
+    with setup_lock:
+        if (key, db_name) not in initialized_databases:
+            setup(db_name)
+            initialized_databases.add((key, db_name))
+
+def setup_database(db_name):
+    # Datenbank einmal pro Prozess auf den aktuellen Schemastand bringen
+    run_once("roles", migrate, db_name)
+
 # Funktionen für Datenbankoperationen
 def get_role_names():
-    with connect_db(db_name) as c:
-        c.execute('SELECT name FROM roles')
-        return [row[0] for row in c.fetchall()]  # Nur Rollennamen zurückgeben
+    global role_names_cache
+    with role_cache_lock:
+        if role_names_cache is None:
+            with connect_db(db_name) as c:
+                c.execute('SELECT name FROM roles')
+                role_names_cache = [row[0] for row in c.fetchall()]  # Nur Rollennamen zurückgeben
+        return list(role_names_cache)
+
+def get_role(name):
+    # Rolle mit einer einzigen Abfrage laden, danach aus dem Cache bedienen (nur gefundene Rollen,
+    # damit beliebige Namen den Cache nicht unbegrenzt wachsen lassen)
+    with role_cache_lock:
+        if name not in role_cache:
+            with connect_db(db_name) as c:
+                c.execute('SELECT id, name, description, ai_model FROM roles WHERE name = ?', (name,))
+                result = c.fetchone()
+            if result is None:
+                return None
+            role_cache[name] = dict(zip(("id", "name", "description", "ai_model"), result))
+        return role_cache[name]
 
 def role_name_exists(name):
-    with connect_db(db_name) as c:
-        # Boolean zurückgeben, ob der Rollenname bereits existiert
-        c.execute('SELECT EXISTS(SELECT 1 FROM roles WHERE name = ?)', (name,))
-        return c.fetchone()[0] == 1
+    # Boolean zurückgeben, ob der Rollenname bereits existiert
+    return get_role(name) is not None
 
 def get_description_by_name(name):
-    with connect_db(db_name) as c:
-        c.execute('SELECT description FROM roles WHERE name = ?', (name,))
-        result = c.fetchone()
-        return result[0] if result else "Beschreibung nicht gefunden."
+    role = get_role(name)
+    return role["description"] if role else "Beschreibung nicht gefunden."
 
 def get_aimodel_by_name(name):
-    with connect_db(db_name) as c:
-        c.execute('SELECT ai_model FROM roles WHERE name = ?', (name,))
-        result = c.fetchone()
-        return result[0] if result else "Beschreibung nicht gefunden."
+    role = get_role(name)
+    return role["ai_model"] if role else "Beschreibung nicht gefunden."
 
 def insert_role(name, description, ai_model):
     validate_input(name, description, ai_model)
     with connect_db(db_name) as c:
-        c.execute('INSERT INTO roles (name, description, ai_model) VALUES (?, ?, ?)', (name, description, ai_model))
+        c.execute('INSERT INTO roles (name, description, ai_model, preview) VALUES (?, ?, ?, ?)',
+                  (name, description, ai_model, make_preview(description)))
+    invalidate_role_cache()
 
 def update_role(id, name, description):
     validate_input(id, name, description)
     with connect_db(db_name) as c:
-        c.execute('UPDATE roles SET name = ?, description = ? WHERE id = ?', (name, description, id))
+        c.execute('UPDATE roles SET name = ?, description = ?, preview = ? WHERE id = ?',
+                  (name, description, make_preview(description), id))
+    invalidate_role_cache()
 
 def delete_role(name):
     with connect_db(db_name) as c:
         c.execute('DELETE FROM roles WHERE name = ?', (name,))
+    invalidate_role_cache()
 
 def list_roles():
     with connect_db(db_name) as c:
         c.execute('SELECT id, name, description, ai_model FROM roles')
         return c.fetchall()
 
+def count_roles():
+    with connect_db(db_name) as c:
+        c.execute('SELECT COUNT(*) FROM roles')
+        return c.fetchone()[0]
+
+def list_roles_page(offset, limit):
+    # Nur eine Seite mit Vorschau statt vollständiger Beschreibung laden
+    with connect_db(db_name) as c:
+        c.execute('SELECT id, name, preview, ai_model FROM roles ORDER BY id LIMIT ? OFFSET ?', (limit, offset))
+        return c.fetchall()
+
+def export_roles():
+    with connect_db(db_name) as c:
+        c.execute('SELECT name, description, ai_model FROM roles ORDER BY id')
+        return [{"name": name, "description": description, "ai_model": ai_model} for name, description, ai_model in c.fetchall()]
+
+def import_roles(roles):
+    # Alle Rollen in einer Transaktion schreiben, vorhandene Namen werden aktualisiert
+    rows = []
+    for role in roles:
+        validate_input(role["name"], role["description"], role["ai_model"])
+        rows.append((role["name"], role["description"], role["ai_model"], make_preview(role["description"])))
+    with connect_db(db_name) as c:
+        c.executemany('''
+        INSERT INTO roles (name, description, ai_model, preview) VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET description = excluded.description, ai_model = excluded.ai_model, preview = excluded.preview
+        ''', rows)
+    invalidate_role_cache()
+    return len(rows)
+
+def setup_conversations(db_name=conversations_db_name):
+    run_once("conversations", create_conversation_tables, db_name)
+
+def create_conversation_tables(db_name):
+    # Tabellen für gespeicherte Chatverläufe erstellen, falls sie nicht existieren
+    with connect_db(db_name) as c:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)')
+
+def create_conversation():
+    conversation_id = uuid.uuid4().hex
+    with connect_db(conversations_db_name) as c:
+        c.execute('INSERT INTO conversations (id) VALUES (?)', (conversation_id,))
+    return conversation_id
+
+def conversation_exists(conversation_id):
+    with connect_db(conversations_db_name) as c:
+        c.execute('SELECT EXISTS(SELECT 1 FROM conversations WHERE id = ?)', (conversation_id,))
+        return c.fetchone()[0] == 1
+
+def add_message(conversation_id, role, content):
+    with connect_db(conversations_db_name) as c:
+        c.execute('INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)', (conversation_id, role, content))
+
+def count_messages(conversation_id):
+    with connect_db(conversations_db_name) as c:
+        c.execute('SELECT COUNT(*) FROM messages WHERE conversation_id = ?', (conversation_id,))
+        return c.fetchone()[0]
+
+def get_recent_messages(conversation_id, limit):
+    with connect_db(conversations_db_name) as c:
+        # Die neuesten Nachrichten laden und in chronologischer Reihenfolge zurückgeben
+        c.execute('SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT ?', (conversation_id, limit))
+        return [{"role": role, "content": content} for role, content in reversed(c.fetchall())]
+
+def setup_transcription_jobs(db_name=transcriptions_db_name):
+    # Tabelle für Transkriptionsaufträge erstellen, falls sie nicht existiert
+    with connect_db(db_name) as c:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS transcription_jobs (
+            id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            model_size TEXT NOT NULL,
+            compute_type TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            audio_seconds REAL,
+            inference_seconds REAL,
+            model_load_seconds REAL,
+            wait_seconds REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        # Spalten für Lade- und Wartezeit in bestehenden Datenbanken ergänzen
+        c.execute('PRAGMA table_info(transcription_jobs)')
+        columns = {row[1] for row in c.fetchall()}
+        for column in ('model_load_seconds', 'wait_seconds'):
+            if column not in columns:
+                c.execute(f'ALTER TABLE transcription_jobs ADD COLUMN {column} REAL')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_transcription_jobs_status ON transcription_jobs (status, created_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_transcription_jobs_owner ON transcription_jobs (owner, created_at)')
+        # Segmente werden fortlaufend angehängt, statt das Transkript nach jedem Abschnitt neu zu schreiben
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS transcription_segments (
+            job_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            start REAL NOT NULL,
+            end REAL NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (job_id, position)
+        )
+        ''')
+
+def create_transcription_job(owner, file_name, file_path, model_size, compute_type):
+    job_id = uuid.uuid4().hex
+    with connect_db(transcriptions_db_name) as c:
+        c.execute('''
+        INSERT INTO transcription_jobs (id, owner, file_name, file_path, model_size, compute_type) VALUES (?, ?, ?, ?, ?, ?)
+        ''', (job_id, owner, file_name, file_path, model_size, compute_type))
+    return job_id
+
+def claim_next_transcription_job():
+    with connect_db(transcriptions_db_name) as c:
+        # Faire Reihenfolge: zuerst Nutzer mit den wenigsten laufenden Aufträgen, dann abwechselnd
+        # der jeweils älteste wartende Auftrag jedes Nutzers, damit viele Dateien eines Nutzers andere nicht blockieren
+        c.execute('''
+        SELECT id, file_path, model_size, compute_type FROM (
+            SELECT id, file_path, model_size, compute_type, created_at, rowid AS position,
+                   ROW_NUMBER() OVER (PARTITION BY owner ORDER BY created_at, rowid) AS owner_rank,
+                   (SELECT COUNT(*) FROM transcription_jobs AS r WHERE r.owner = j.owner AND r.status = 'running') AS running
+            FROM transcription_jobs AS j WHERE status = 'queued'
+        )
+        ORDER BY running, owner_rank, created_at, position
+        LIMIT 1
+        ''')
+        row = c.fetchone()
+        if row is None:
+            return None
+        c.execute("UPDATE transcription_jobs SET status = 'running' WHERE id = ? AND status = 'queued'", (row[0],))
+        if c.rowcount != 1:
+            return None
+        return {"id": row[0], "file_path": row[1], "model_size": row[2], "compute_type": row[3]}
+
+def append_transcription_segments(job_id, position, segments, progress, audio_seconds=None):
+    # Nur die neuen Segmente ab position speichern
+    with connect_db(transcriptions_db_name) as c:
+        c.executemany('''
+        INSERT OR REPLACE INTO transcription_segments (job_id, position, start, end, text) VALUES (?, ?, ?, ?, ?)
+        ''', [(job_id, position + index, segment["start"], segment["end"], segment["text"])
+              for index, segment in enumerate(segments)])
+        c.execute('''
+        UPDATE transcription_jobs SET progress = ?, audio_seconds = COALESCE(?, audio_seconds) WHERE id = ?
+        ''', (progress, audio_seconds, job_id))
+
+def finish_transcription_job(job_id, audio_seconds, inference_seconds, model_load_seconds=None, wait_seconds=None):
+    with connect_db(transcriptions_db_name) as c:
+        c.execute('''
+        UPDATE transcription_jobs SET status = 'done', progress = 1, audio_seconds = ?, inference_seconds = ?,
+            model_load_seconds = ?, wait_seconds = ?
+        WHERE id = ?
+        ''', (audio_seconds, inference_seconds, model_load_seconds, wait_seconds, job_id))
+
+def fail_transcription_job(job_id, error):
+    with connect_db(transcriptions_db_name) as c:
+        c.execute("UPDATE transcription_jobs SET status = 'error', error = ? WHERE id = ?", (error, job_id))
+
+def requeue_running_transcription_jobs():
+    # Aufträge, die bei einem Neustart noch liefen, erneut einreihen
+    with connect_db(transcriptions_db_name) as c:
+        c.execute("DELETE FROM transcription_segments WHERE job_id IN (SELECT id FROM transcription_jobs WHERE status = 'running')")
+        c.execute("UPDATE transcription_jobs SET status = 'queued', progress = 0 WHERE status = 'running'")
+
+def list_transcription_jobs(owner):
+    with connect_db(transcriptions_db_name) as c:
+        c.execute('''
+        SELECT id, file_name, status, progress, error, audio_seconds, inference_seconds, model_load_seconds,
+               wait_seconds, model_size
+        FROM transcription_jobs WHERE owner = ? ORDER BY created_at, rowid
+        ''', (owner,))
+        columns = [column[0] for column in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+
+def get_transcription_segments(job_id, last=None):
+    # Alle Segmente oder nur die letzten last Segmente in zeitlicher Reihenfolge
+    with connect_db(transcriptions_db_name) as c:
+        if last is None:
+            c.execute('SELECT start, end, text FROM transcription_segments WHERE job_id = ? ORDER BY position', (job_id,))
+            rows = c.fetchall()
+        else:
+            c.execute('''
+            SELECT start, end, text FROM transcription_segments WHERE job_id = ? ORDER BY position DESC LIMIT ?
+            ''', (job_id, last))
+            rows = reversed(c.fetchall())
+        return [{"start": start, "end": end, "text": text} for start, end, text in rows]
+
+def delete_transcription_job(job_id, owner):
+    # Gibt den Pfad der hochgeladenen Datei zurück, damit sie entfernt werden kann (None, wenn nichts gelöscht wurde)
+    with connect_db(transcriptions_db_name) as c:
+        c.execute("SELECT file_path FROM transcription_jobs WHERE id = ? AND owner = ? AND status IN ('done', 'error')",
+                  (job_id, owner))
+        row = c.fetchone()
+        if row is None:
+            return None
+        c.execute('DELETE FROM transcription_segments WHERE job_id = ?', (job_id,))
+        c.execute('DELETE FROM transcription_jobs WHERE id = ?', (job_id,))
+        return row[0]
+
+def setup_video_jobs(db_name=videos_db_name):
+    # Tabelle für HeyGen-Videos erstellen, falls sie nicht existiert
+    with connect_db(db_name) as c:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS video_jobs (
+            video_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            title TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            payload TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_poll_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_video_jobs_poll ON video_jobs (status, next_poll_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_video_jobs_owner ON video_jobs (owner, created_at)')
+
+def create_video_job(video_id, owner, title, next_poll_at):
+    with connect_db(videos_db_name) as c:
+        c.execute('''
+        INSERT INTO video_jobs (video_id, owner, title, next_poll_at) VALUES (?, ?, ?, ?)
+        ''', (video_id, owner, title, next_poll_at))
+
+def get_due_video_jobs(now, final_statuses):
+    with connect_db(videos_db_name) as c:
+        placeholders = ", ".join("?" * len(final_statuses))
+        c.execute(f'''
+        SELECT video_id, attempts FROM video_jobs WHERE status NOT IN ({placeholders}) AND next_poll_at <= ?
+        ORDER BY next_poll_at
+        ''', (*final_statuses, now))
+        return [{"video_id": video_id, "attempts": attempts} for video_id, attempts in c.fetchall()]
+
+def get_next_video_poll_time(final_statuses):
+    with connect_db(videos_db_name) as c:
+        placeholders = ", ".join("?" * len(final_statuses))
+        c.execute(f'SELECT MIN(next_poll_at) FROM video_jobs WHERE status NOT IN ({placeholders})', final_statuses)
+        return c.fetchone()[0]
+
+def update_video_job(video_id, status, payload, attempts, next_poll_at):
+    with connect_db(videos_db_name) as c:
+        c.execute('''
+        UPDATE video_jobs SET status = COALESCE(?, status), payload = COALESCE(?, payload), attempts = ?, next_poll_at = ? WHERE video_id = ?
+        ''', (status, json.dumps(payload) if payload is not None else None, attempts, next_poll_at, video_id))
+
+def list_video_jobs(owner):
+    with connect_db(videos_db_name) as c:
+        c.execute('''
+        SELECT video_id, title, status, payload, attempts, created_at FROM video_jobs WHERE owner = ? ORDER BY created_at DESC, rowid DESC
+        ''', (owner,))
+        columns = [column[0] for column in c.description]
+        jobs = [dict(zip(columns, row)) for row in c.fetchall()]
+    for job in jobs:
+        job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+    return jobs
+
+def delete_video_job(video_id, owner):
+    with connect_db(videos_db_name) as c:
+        c.execute('DELETE FROM video_jobs WHERE video_id = ? AND owner = ?', (video_id, owner))
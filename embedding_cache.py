@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# Zugriffszeiten werden gesammelt und erst ab dieser Anzahl (oder beim nächsten Schreiben) gespeichert
+TOUCH_FLUSH_SIZE = 1000
+
+
+class EmbeddingCache:
+    """
+    Persistenter Cache für Embeddings in SQLite.
+    Schlüssel ist der SHA-256 Hash aus Modellname und Text, bei Überschreitung
+    von max_entries werden die am längsten nicht genutzten Einträge entfernt (LRU).
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Ausstehende Aktualisierungen von last_used, damit Lesezugriffe nicht jedes Mal schreiben
+        self._touched = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+        self._entries = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    @staticmethod
+    def make_key(model, text):
+        """Erzeugt den Cache-Schlüssel für einen Text."""
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    def get_many(self, model, texts):
+        """
+        Liefert die gespeicherten Embeddings in der Reihenfolge der Texte.
+        Für nicht gefundene Texte steht None an der entsprechenden Stelle.
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # SQLite begrenzt die Anzahl der Parameter pro Statement
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                rows = self._conn.execute(
+                    f'SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})', part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._touched.update((key, now) for key in found)
+                if len(self._touched) >= TOUCH_FLUSH_SIZE:
+                    self._flush_touched()
+                    self._conn.commit()
+            results = []
+            for key in keys:
+                blob = found.get(key)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.frombuffer(blob, dtype=np.float32).tolist())
+        return results
+
+    def _flush_touched(self):
+        """Schreibt die gesammelten Zugriffszeiten in einem Durchgang (nur mit gehaltenem Lock aufrufen)."""
+        if self._touched:
+            self._conn.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?',
+                                   [(now, key) for key, now in self._touched.items()])
+            self._touched.clear()
+
+    def put_many(self, model, texts, embeddings):
+        """Speichert Embeddings und entfernt bei Bedarf die ältesten Einträge."""
+        now = time.time()
+        rows = [(self.make_key(model, text), model, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+                for text, embedding in zip(texts, embeddings)]
+        with self._lock:
+            # Zugriffszeiten vor der Verdrängung speichern, damit kürzlich gelesene Einträge erhalten bleiben
+            self._flush_touched()
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO embeddings (key, model, embedding, last_used) VALUES (?, ?, ?, ?)', rows
+            )
+            self._entries += self._conn.total_changes - before
+            if self._entries > self.max_entries:
+                overflow = self._entries - self.max_entries
+                self._conn.execute(
+                    'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (overflow,)
+                )
+                self._entries -= overflow
+            self._conn.commit()
+
+    def stats(self):
+        """Gibt Treffer, Fehlzugriffe und die Anzahl gespeicherter Einträge zurück."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": self._entries,
+            }
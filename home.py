@@ -1,4 +1,8 @@
+import json
+import time
 import streamlit as st
+import streamlit.components.v1 as components
+from transcription import warm_up_models
 
 st.set_page_config(
     page_title="Luminis - KI-Labor und Lernplattform",
@@ -7,6 +11,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Whisper-Modell bereits beim Start im Hintergrund laden
+warm_up_models()
+
 st.title("Willkommen in Luminis! Lernplattform für KI-Pioniere")
 
 col1a, col2a = st.columns([1, 1])
@@ -26,6 +33,27 @@ with col2b:
     st.write("StefanAI - Research & Development ist ein Forschungs- und Entwicklungsunternehmen, das sich auf die Entwicklung von KI-Technologien spezialisiert hat. Wir bieten innovative Lösungen für Unternehmen und Organisationen, die ihre Prozesse optimieren und automatisieren möchten. Unser Team besteht aus Experten auf dem Gebiet der künstlichen Intelligenz, die über umfangreiche Erfahrung in der Entwicklung von KI-Systemen verfügen. Wir arbeiten eng mit unseren Kunden zusammen, um maßgeschneiderte Lösungen zu entwickeln, die ihren individuellen Anforderungen entsprechen. Unser Ziel ist es, unseren Kunden dabei zu helfen, ihre Geschäftsziele zu erreichen und Wettbewerbsvorteile zu erzielen.")
 
 
+def schedule_refresh(seconds, button_label="Aktualisieren"):
+    """
+    Klickt nach seconds Sekunden im Browser auf den Button mit der Beschriftung button_label und löst so
+    einen Rerun aus. Anders als time.sleep mit st.rerun bleibt der Skript-Thread dabei nicht blockiert.
+    """
+    # Der Zeitstempel macht den Inhalt bei jedem Rerun neu, damit der Timer erneut gestartet wird
+    components.html(f"""
+    <script>
+    // {time.time()}
+    setTimeout(function () {{
+        for (const button of window.parent.document.querySelectorAll("button")) {{
+            if (button.innerText.trim() === {json.dumps(button_label)}) {{
+                button.click();
+                break;
+            }}
+        }}
+    }}, {int(seconds * 1000)});
+    </script>
+    """, height=0)
+
+
 def add_menu():
 
     st.sidebar.image("luminis_logo.png", use_column_width=True)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+
+def normalize_parameters(parameters):
+    """Vereinheitlicht Texte (Leerraum) und Zahlen, damit gleichwertige Anfragen denselben Schlüssel erhalten."""
+    normalized = {}
+    for name, value in parameters.items():
+        if isinstance(value, str):
+            value = re.sub(r'\s+', ' ', value).strip()
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        normalized[name] = value
+    return normalized
+
+
+class ImageCache:
+    """
+    Cache für erzeugte Bilder auf der Festplatte, adressiert über den Hash aus Anbieter und Parametern.
+    Die Gesamtgröße ist auf max_bytes begrenzt; bei Überschreitung werden die am längsten nicht
+    genutzten Bilder (ältester Änderungszeitpunkt) gelöscht. Jeder Treffer aktualisiert den Zeitpunkt.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def make_key(provider, parameters):
+        payload = json.dumps({"provider": provider, **normalize_parameters(parameters)}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".png"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key):
+        """Gibt die PNG-Daten zurück oder None, wenn das Bild nicht im Cache liegt."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                image = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return image
+
+    def put(self, key, image):
+        """Speichert ein Bild und entfernt bei Bedarf die am längsten nicht genutzten Bilder."""
+        if len(image) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Erst in eine temporäre Datei schreiben, damit andere Sessions nie ein halbes Bild lesen
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            f.write(image)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._files())
+            if os.path.exists(path):
+                self._size -= os.path.getsize(path)
+            os.replace(f.name, path)
+            self._size += len(image)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        files = sorted(self._files(), key=lambda file: file[2])
+        self._size = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
@@ -0,0 +1,145 @@
+import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from dotenv import load_dotenv
+from openai import OpenAI
+from image_cache import ImageCache
+
+load_dotenv()
+
+STABILITY_API_KEY = os.getenv("STABILITY_API_KEY")
+STABILITY_BASE_URL = os.getenv("STABILITY_BASE_URL", "https://api.stability.ai")
+STABILITY_ENGINE = os.getenv("STABILITY_ENGINE", "stable-diffusion-xl-1024-v1-0")
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", 120))
+# Gleichzeitige Bildanfragen, gemeinsam für alle Sessions
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", 4))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+DALLE_SIZES = ['1024x1024', '1024x1792', '1792x1024']
+STABILITY_STYLE_PRESETS = ["analog-film", "anime", "cinematic", "comic-book", "digital-art", "enhance", "fantasy-art",
+                           "isometric", "line-art", "low-poly", "modeling-compound", "neon-punk", "origami",
+                           "photographic", "pixel-art", "tile-texture"]
+STABILITY_SIZES = ["1024x1024", "1152x896", "1216x832", "1344x768", "1536x640", "640x1536", "768x1344", "832x1216",
+                   "896x1152"]
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_MAX_CONCURRENCY, thread_name_prefix="image")
+openai_client = OpenAI(timeout=IMAGE_TIMEOUT)
+# Eine Session pro Thread, damit Verbindungen wiederverwendet werden
+local_sessions = threading.local()
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+
+
+class ImageGenerationError(Exception):
+    """Fehler eines Bildanbieters mit einer für Nutzer verständlichen Meldung."""
+
+
+def get_session():
+    session = getattr(local_sessions, "session", None)
+    if session is None:
+        session = local_sessions.session = requests.Session()
+        session.headers.update({
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {STABILITY_API_KEY}",
+        })
+    return session
+
+
+def create_dalle_image(description, size):
+    """Erzeugt ein Bild mit DALL-E 3 und gibt die PNG-Daten zurück."""
+    try:
+        response = openai_client.images.generate(
+            model="dall-e-3",
+            prompt=f"{description}",
+            size=f"{size}",
+            quality="standard",
+            response_format="b64_json",
+            n=1
+        )
+    except Exception as e:
+        print(f"DALL-E error: {e}")
+        raise ImageGenerationError('Sorry, die Content-Filterung von Openai.com hat die Bildbeschreibung abgelehnt. '
+                                   'Vermutlich weil sie anstößig ist.') from e
+    return base64.b64decode(response.data[0].b64_json)
+
+
+def create_stability_image(description, anti_description, steps, style_preset, size, cfg_scale, seed=0):
+    """Erzeugt ein Bild mit Stability AI und gibt die PNG-Daten zurück (seed 0 wählt einen zufälligen Seed)."""
+    size_width, size_height = (int(part) for part in size.split("x"))
+    body = {
+        "steps": steps,
+        "style_preset": style_preset,
+        "width": size_width,
+        "height": size_height,
+        "seed": seed,
+        "cfg_scale": cfg_scale,
+        "samples": 1,
+        "text_prompts": [
+            {"text": description, "weight": 1},
+            {"text": anti_description, "weight": -1}
+        ],
+    }
+    url = f"{STABILITY_BASE_URL}/v1/generation/{STABILITY_ENGINE}/text-to-image"
+    try:
+        response = get_session().post(url, json=body, timeout=IMAGE_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"An error occurred: {e}")
+        raise ImageGenerationError("Stability AI ist nicht erreichbar.") from e
+    if response.status_code != 200:
+        print(f"Error: {response.status_code}, {response.text}")
+        raise ImageGenerationError("Sorry, die Content-Filterung von Stability AI hat die Bildbeschreibung abgelehnt. "
+                                   "Vermutlich weil sie anstößig ist.")
+    artifact = response.json()["artifacts"][0]
+    if artifact.get("finishReason") == "CONTENT_FILTERED":
+        raise ImageGenerationError("Sorry, die Content-Filterung von Stability AI hat das Bild gefiltert.")
+    return base64.b64decode(artifact["base64"])
+
+
+def is_deterministic(provider, parameters):
+    """Stability liefert bei festem Seed (ungleich 0) immer dasselbe Bild, DALL-E nie."""
+    return provider == "stability" and parameters.get("seed", 0) != 0
+
+
+def generate_cached_image(provider, function, parameters, sample=0, reuse_random=False):
+    """
+    Erzeugt ein Bild über function(**parameters) oder liefert es aus dem Bild-Cache.
+    Deterministische Anfragen werden immer zwischengespeichert. Zufällige Ergebnisse (DALL-E,
+    Stability mit Seed 0) nur, wenn reuse_random gesetzt ist; sample unterscheidet dann mehrere
+    Bilder mit denselben Parametern.
+    """
+    if is_deterministic(provider, parameters):
+        key = image_cache.make_key(provider, parameters)
+    elif reuse_random:
+        key = image_cache.make_key(provider, {**parameters, "sample": sample})
+    else:
+        return function(**parameters)
+    image = image_cache.get(key)
+    if image is None:
+        image = function(**parameters)
+        image_cache.put(key, image)
+    return image
+
+
+def generate_images(tasks):
+    """
+    Führt mehrere Bildanfragen parallel aus.
+    :param tasks: Liste von (Funktion, Argumente) Tupeln, z.B. (generate_cached_image, ("dalle", create_dalle_image, {...})).
+    :return: Generator über (Index, PNG-Daten, Fehlermeldung) in der Reihenfolge der Fertigstellung.
+    """
+    futures = {image_executor.submit(function, *args): index for index, (function, args) in enumerate(tasks)}
+    try:
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except ImageGenerationError as e:
+                yield futures[future], None, str(e)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                yield futures[future], None, f"Ein Fehler ist aufgetreten: {e}"
+    finally:
+        # Bei Abbruch (z.B. neue Eingabe in Streamlit) noch nicht gestartete Anfragen verwerfen
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,177 @@
+import heapq
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from functools import lru_cache
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+# Paragraphen-Verweise wie "§ 12a" bleiben als ein Token erhalten
+TOKEN_PATTERN = re.compile(r'§+\s*\d+[a-z]*|[a-z0-9]+')
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+stemmer = PorterStemmer()
+
+
+def load_stopwords():
+    """Lädt die NLTK-Stoppwörter, bereinigt wie die gespeicherten Chunks (siehe vector.clean_text)."""
+    words = set()
+    for language in ("german", "english"):
+        try:
+            words.update(stopwords.words(language))
+        except LookupError:
+            # Korpus nicht heruntergeladen (nltk.download('stopwords')), dann ohne Stoppwörter
+            pass
+    return {re.sub(r'[^a-z0-9]', '', word.lower()) for word in words} - {""}
+
+
+STOPWORDS = load_stopwords()
+
+
+@lru_cache(maxsize=100000)
+def stem(token):
+    """Gibt den Wortstamm zurück, Paragraphen und Zahlen bleiben unverändert."""
+    if token.startswith('§') or token.isdigit():
+        return token
+    return stemmer.stem(token)
+
+
+def analyze(text):
+    """Zerlegt einen bereinigten Text in Terme für den invertierten Index."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text):
+        token = re.sub(r'\s+', '', token)
+        if token in STOPWORDS:
+            continue
+        terms.append(stem(token))
+    return terms
+
+
+class LexicalIndex:
+    """
+    Invertierter Index pro Collection für BM25-Suche neben ChromaDB.
+    Die Postings werden in SQLite persistiert und beim ersten Zugriff auf eine Collection
+    in den Speicher geladen, damit die Suche ohne Datenbankzugriff auskommt.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._collections = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS lexical_postings (
+            collection TEXT NOT NULL,
+            chunk_id TEXT NOT NULL,
+            term TEXT NOT NULL,
+            tf INTEGER NOT NULL
+        )
+        ''')
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS lexical_chunks (
+            collection TEXT NOT NULL,
+            chunk_id TEXT NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (collection, chunk_id)
+        )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_lexical_postings_chunk ON lexical_postings (collection, chunk_id)')
+        self._conn.commit()
+
+    def _load(self, collection):
+        """Lädt die Postings einer Collection in den Speicher (muss unter dem Lock aufgerufen werden)."""
+        index = self._collections.get(collection)
+        if index is None:
+            index = {"postings": {}, "lengths": {}, "total_length": 0}
+            for chunk_id, length in self._conn.execute(
+                    'SELECT chunk_id, length FROM lexical_chunks WHERE collection = ?', (collection,)):
+                index["lengths"][chunk_id] = length
+                index["total_length"] += length
+            for chunk_id, term, tf in self._conn.execute(
+                    'SELECT chunk_id, term, tf FROM lexical_postings WHERE collection = ?', (collection,)):
+                index["postings"].setdefault(term, {})[chunk_id] = tf
+            self._collections[collection] = index
+        return index
+
+    def _remove(self, index, collection, ids):
+        """Entfernt Chunks aus Speicher und Datenbank (muss unter dem Lock aufgerufen werden)."""
+        removed = [chunk_id for chunk_id in ids if chunk_id in index["lengths"]]
+        if not removed:
+            return
+        removed_set = set(removed)
+        for chunk_id in removed:
+            index["total_length"] -= index["lengths"].pop(chunk_id)
+        for term in list(index["postings"]):
+            postings = index["postings"][term]
+            for chunk_id in removed_set.intersection(postings):
+                del postings[chunk_id]
+            if not postings:
+                del index["postings"][term]
+        rows = [(collection, chunk_id) for chunk_id in removed]
+        self._conn.executemany('DELETE FROM lexical_postings WHERE collection = ? AND chunk_id = ?', rows)
+        self._conn.executemany('DELETE FROM lexical_chunks WHERE collection = ? AND chunk_id = ?', rows)
+
+    def add(self, collection, ids, documents):
+        """Fügt Chunks hinzu oder ersetzt sie, wenn die ID bereits vorhanden ist."""
+        with self._lock:
+            index = self._load(collection)
+            self._remove(index, collection, ids)
+            chunk_rows = []
+            posting_rows = []
+            for chunk_id, document in zip(ids, documents):
+                terms = analyze(document)
+                index["lengths"][chunk_id] = len(terms)
+                index["total_length"] += len(terms)
+                chunk_rows.append((collection, chunk_id, len(terms)))
+                for term, tf in Counter(terms).items():
+                    index["postings"].setdefault(term, {})[chunk_id] = tf
+                    posting_rows.append((collection, chunk_id, term, tf))
+            self._conn.executemany('INSERT INTO lexical_chunks (collection, chunk_id, length) VALUES (?, ?, ?)', chunk_rows)
+            self._conn.executemany('INSERT INTO lexical_postings (collection, chunk_id, term, tf) VALUES (?, ?, ?, ?)', posting_rows)
+            self._conn.commit()
+
+    def remove(self, collection, ids):
+        """Entfernt Chunks aus dem Index."""
+        with self._lock:
+            self._remove(self._load(collection), collection, ids)
+            self._conn.commit()
+
+    def drop(self, collection):
+        """Entfernt den kompletten Index einer Collection."""
+        with self._lock:
+            self._collections.pop(collection, None)
+            self._conn.execute('DELETE FROM lexical_postings WHERE collection = ?', (collection,))
+            self._conn.execute('DELETE FROM lexical_chunks WHERE collection = ?', (collection,))
+            self._conn.commit()
+
+    def size(self, collection):
+        """Gibt die Anzahl der indexierten Chunks einer Collection zurück."""
+        with self._lock:
+            return len(self._load(collection)["lengths"])
+
+    def search(self, collection, query, n_results):
+        """
+        Sucht per BM25 in einer Collection.
+        :param query: Bereinigter Abfragetext.
+        :return: Liste von Tupeln (Chunk-ID, Score), absteigend nach Score.
+        """
+        terms = set(analyze(query))
+        with self._lock:
+            index = self._load(collection)
+            chunk_count = len(index["lengths"])
+            if not chunk_count or not terms:
+                return []
+            average_length = index["total_length"] / chunk_count or 1
+            scores = {}
+            for term in terms:
+                postings = index["postings"].get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    length_norm = 1 - BM25_B + BM25_B * index["lengths"][chunk_id] / average_length
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+        return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
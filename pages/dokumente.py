@@ -1,10 +1,10 @@
 from openai import OpenAI
 import os
 import streamlit as st
-import chromadb
 import anthropic
 from mistralai.client import MistralClient
-from vector import list_collections, query_collection, clean_collection_name, extract_text_from_pdf, hash_file_content, add_document_to_collection
+from vector import list_collections, query_collection, clean_collection_name, hash_file_content, add_document_to_collection, count_indexed_chunks, get_or_create_collection, delete_collection
+from pdf_pipeline import extract_chunks_parallel
 from home import add_menu
 
 st.set_page_config(
@@ -15,7 +15,6 @@ st.set_page_config(
 )
 
 
-chroma_client = chromadb.EphemeralClient()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
@@ -32,19 +31,40 @@ chunk_size = st.slider('Chunk-Size festlegen:', 256, 2048, 512, help='In wie kle
 uploaded_files = st.file_uploader("PDF-Dateien hochladen:", type=["pdf"], accept_multiple_files=True)
 
 if st.button("Zur Sammlung hinzufügen oder hinzufügen!"):
-    cleaned_collection_name = clean_collection_name(collection_name)
-    collection = chroma_client.get_or_create_collection(name=cleaned_collection_name)
-
     if uploaded_files and collection_name:
-        for doc_id, uploaded_file in enumerate(uploaded_files, start=1):
-            with st.spinner(f"Verarbeite Dokument {doc_id}..."):
-                text = extract_text_from_pdf(uploaded_file)
-                if text:
-                    hash_value = hash_file_content(text)
-                    add_document_to_collection(collection, text, doc_id, hash_value, chunk_size, collection_describtion)
-                    st.success(f"Dokument {doc_id} erfolgreich zur Sammlung hinzugefügt oder ergänzt.")
-                else:
-                    st.error(f"Die PDF-Datei {doc_id} scheint keinen Text zu enthalten.")
+        cleaned_collection_name = clean_collection_name(collection_name)
+        collection = get_or_create_collection(cleaned_collection_name)
+        saved_embeddings = 0
+        pending_files = []
+        for uploaded_file in uploaded_files:
+            file_bytes = uploaded_file.getvalue()
+            hash_value = hash_file_content(file_bytes)
+            indexed_chunks = count_indexed_chunks(collection, hash_value, chunk_size)
+            if indexed_chunks:
+                # Unveränderte Dokumente werden gar nicht erst extrahiert
+                saved_embeddings += indexed_chunks
+                st.info(f"Dokument {uploaded_file.name} ist unverändert und bereits in der Sammlung.")
+            else:
+                pending_files.append((uploaded_file.name, file_bytes, hash_value))
+
+        progress_bars = [st.progress(0.0, text=f"{name}: wartet auf Extraktion...") for name, _, _ in pending_files]
+
+        def show_progress(index, done, total):
+            progress_bars[index].progress(done / total, text=f"{pending_files[index][0]}: {done} von {total} Seitenbereichen verarbeitet")
+
+        # Extraktion läuft im Prozess-Pool, die Chunks werden während der Extraktion eingebettet
+        for index, chunks in extract_chunks_parallel([file_bytes for _, file_bytes, _ in pending_files], chunk_size, show_progress):
+            name, _, hash_value = pending_files[index]
+            stats = add_document_to_collection(collection, chunks, name, hash_value, chunk_size, collection_describtion,
+                                               indexed_chunks=0)
+            saved_embeddings += stats["reused"]
+            progress_bars[index].progress(1.0, text=f"{name}: fertig")
+            if stats["embedded"] + stats["reused"] == 0:
+                st.error(f"Die PDF-Datei {name} scheint keinen Text zu enthalten.")
+            else:
+                st.success(f"Dokument {name} erfolgreich zur Sammlung hinzugefügt oder ergänzt "
+                           f"({stats['embedded']} Chunks neu eingebettet, {stats['reused']} übernommen, {stats['deleted']} entfernt).")
+        st.write(f"Eingesparte Embeddings: {saved_embeddings}")
     else:
         st.error(
             "Bitte geben Sie einen Namen für die Sammlung vergeben und laden Sie mindestens eine PDF-Datei hoch.")
@@ -54,7 +74,7 @@ st.write("## Dokumenten-Sammlung löschen")
 delete_collection_name = st.selectbox("Wählen Sie eine Dokumenten-Sammlung aus:", list_collections())
 if st.button("Bestehende Sammlung löschen!"):
     if delete_collection_name:
-        chroma_client.delete_collection(name=delete_collection_name)
+        delete_collection(delete_collection_name)
         st.success(f"Sammlung '{delete_collection_name}' wurde erfolgreich gelöscht.")
 
 add_menu()
\ No newline at end of file
@@ -1,25 +1,24 @@
-import os
-from openai import OpenAI
+import csv
+import io
+import json
+import math
 import database as db
 from PIL import Image
 from dotenv import load_dotenv
 import streamlit as st
 import pandas as pd
-import anthropic
-from mistralai.client import MistralClient
+from providers import ChatStream, get_provider
+from stream_renderer import render_stream
 from home import add_menu
 
 
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+# Anzahl der Rollen pro Seite in der Rollenliste
+ROLES_PER_PAGE = 20
 
-openai_client = OpenAI()
-anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-mistral_client = MistralClient(api_key=MISTRAL_API_KEY)
+db.setup_database(db.db_name)
 
 st.set_page_config(
     page_title="Luminis - KI-Labor und Lernplattform",
@@ -49,13 +48,62 @@ with st.form("role_form", clear_on_submit=True):
 
 # Rollenliste
 st.subheader('Vorhandene Rollen')
-roles = db.list_roles()
-roles_df = pd.DataFrame(roles, columns=['id', 'Name', 'Beschreibung', 'KI-Modell'])
-st.dataframe(roles_df[['id', 'Name', 'Beschreibung', 'KI-Modell']], hide_index=True)
+page_count = max(1, math.ceil(db.count_roles() / ROLES_PER_PAGE))
+page = st.number_input('Seite:', min_value=1, max_value=page_count, value=1, help=f'{page_count} Seite(n)')
+roles = db.list_roles_page((page - 1) * ROLES_PER_PAGE, ROLES_PER_PAGE)
+roles_df = pd.DataFrame(roles, columns=['id', 'Name', 'Vorschau', 'KI-Modell'])
+st.dataframe(roles_df, hide_index=True)
+role_names = db.get_role_names()
+
+# Import und Export aller Rollen als JSON oder CSV
+st.subheader('Rollen importieren und exportieren')
+col1, col2 = st.columns([1, 1])
+with col1:
+    import_file = st.file_uploader('JSON- oder CSV-Datei mit den Spalten name, description, ai_model:', type=['json', 'csv'])
+    if import_file is not None and st.button('Rollen importieren'):
+        try:
+            if import_file.name.lower().endswith('.json'):
+                imported_roles = json.loads(import_file.getvalue().decode('utf-8'))
+            else:
+                imported_roles = list(csv.DictReader(io.StringIO(import_file.getvalue().decode('utf-8'))))
+            count = db.import_roles(imported_roles)
+            st.success(f'{count} Rollen importiert oder aktualisiert.')
+            st.rerun()
+        except (ValueError, KeyError, TypeError) as e:
+            st.error(f'Import fehlgeschlagen: {e}')
+with col2:
+    if st.button('Export vorbereiten'):
+        exported_roles = db.export_roles()
+        st.download_button('Rollen als JSON herunterladen', json.dumps(exported_roles, ensure_ascii=False, indent=2),
+                           file_name='rollen.json', mime='application/json')
+        csv_output = io.StringIO()
+        writer = csv.DictWriter(csv_output, fieldnames=['name', 'description', 'ai_model'])
+        writer.writeheader()
+        writer.writerows(exported_roles)
+        st.download_button('Rollen als CSV herunterladen', csv_output.getvalue(), file_name='rollen.csv', mime='text/csv')
+
+# Rolle mit einer Testfrage ausprobieren
+st.subheader("Rolle testen")
+test_role_name = st.selectbox("Wählen Sie eine Rolle zum Testen aus:", role_names)
+test_prompt = st.text_input("Testfrage:", "Stelle dich kurz vor.")
+if st.button("Rolle testen!"):
+    if test_role_name and test_prompt:
+        test_role = db.get_role(test_role_name)
+        test_model = test_role["ai_model"]
+        try:
+            render_stream(ChatStream(
+                test_model,
+                test_role["description"],
+                [{"role": "user", "content": test_prompt}],
+                0.7,
+                500,
+            ), st, get_provider(test_model), test_model)
+        except Exception as e:
+            st.error(f"Die Anfrage ist fehlgeschlagen: {e}")
 
 # Abschnitt für das Löschen von Collections
 st.subheader("Rollen löschen")
-delete_role_name = st.selectbox("Wählen Sie ein Rolle aus:", roles_df['Name'].tolist())
+delete_role_name = st.selectbox("Wählen Sie ein Rolle aus:", role_names)
 if st.button("Bestehende Sammlung löschen!"):
     if delete_role_name:
         db.delete_role(name=delete_role_name)
@@ -1,7 +1,12 @@
-from faster_whisper import WhisperModel
+import os
+import uuid
 from tempfile import NamedTemporaryFile
 import streamlit as st
-from home import add_menu
+import database as db
+from home import add_menu, schedule_refresh
+from transcription import (WHISPER_ALLOWED_COMPUTE_TYPES, WHISPER_ALLOWED_MODEL_SIZES, WHISPER_COMPUTE_TYPE,
+                           WHISPER_MODEL_SIZE, delete_transcription_job, format_timestamp, format_transcript,
+                           start_transcription_workers, submit_transcription_job, warm_up_models)
 
 st.set_page_config(
     page_title="Luminis - KI-Labor und Lernplattform",
@@ -10,17 +15,21 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Abstand in Sekunden, in dem die Seite bei laufenden Aufträgen neu geladen wird
+JOB_REFRESH_SECONDS = float(os.getenv("TRANSCRIPTION_REFRESH_SECONDS", 2))
+# Anzahl der zuletzt erkannten Zeilen, die während der Transkription angezeigt werden
+PREVIEW_LINES = 5
 
-def transcribe_podcast_faster(file_path):
-    model_size = "tiny"
-    # Passen Sie die device und compute_type Parameter entsprechend Ihrer Umgebung an
-    model = WhisperModel(model_size, device="cpu", compute_type="int8")
-    segments, info = model.transcribe(file_path, beam_size=5)
+warm_up_models()
+start_transcription_workers()
 
-    print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
 
-    full_text = "\n".join([segment.text for segment in segments])
-    return full_text
+def get_owner_id():
+    """Gibt die ID zurück, unter der die Aufträge dieser Sitzung gespeichert werden (bleibt in der URL erhalten)."""
+    if "transcription_owner" not in st.session_state:
+        st.session_state.transcription_owner = st.query_params.get("jobs") or uuid.uuid4().hex
+    st.query_params["jobs"] = st.session_state.transcription_owner
+    return st.session_state.transcription_owner
 
 def save_uploaded_file(uploaded_file):
     try:
@@ -30,21 +39,81 @@ def save_uploaded_file(uploaded_file):
     except Exception as e:
         return None
 
+def display_job(job, owner):
+    """Zeigt Status, Fortschritt und Ergebnis eines Auftrags an."""
+    with st.container(border=True):
+        st.markdown(f"**{job['file_name']}** ({job['model_size']})")
+        if job["status"] == "queued":
+            st.progress(0.0, text="In der Warteschlange...")
+        elif job["status"] == "running":
+            st.progress(job["progress"], text=f"Transkription läuft... {job['progress']:.0%}")
+            preview = db.get_transcription_segments(job["id"], last=PREVIEW_LINES)
+            if preview:
+                st.code(format_transcript(preview, with_timestamps=True), language="text")
+        else:
+            if job["status"] == "error":
+                st.error(f"Transkription fehlgeschlagen: {job['error']}")
+            else:
+                segments = db.get_transcription_segments(job["id"])
+                st.success(f"Transkription von {format_timestamp(job['audio_seconds'] or 0)} Audio "
+                           f"in {job['inference_seconds'] or 0:.1f}s abgeschlossen!")
+                if job["model_load_seconds"] is not None:
+                    # Das Modell wird einmal pro Prozess geladen und von allen Aufträgen geteilt
+                    st.caption(f"Modell geladen in {job['model_load_seconds']:.1f}s (einmalig pro Prozess), "
+                               f"gewartet {job['wait_seconds']:.1f}s, Transkription {job['inference_seconds']:.1f}s")
+                with st.expander("Transkript anzeigen"):
+                    st.code(format_transcript(segments, with_timestamps=True), language="text")
+                base_name = os.path.splitext(job["file_name"])[0]
+                col1, col2 = st.columns([1, 1])
+                with col1:
+                    st.download_button("Text herunterladen", format_transcript(segments),
+                                       file_name=f"{base_name}.txt", key=f"text_{job['id']}")
+                with col2:
+                    st.download_button("Mit Zeitstempeln herunterladen",
+                                       format_transcript(segments, with_timestamps=True),
+                                       file_name=f"{base_name}_zeitstempel.txt", key=f"timestamps_{job['id']}")
+            if st.button("Entfernen", key=f"delete_{job['id']}"):
+                delete_transcription_job(job["id"], owner)
+                st.rerun()
+
+owner = get_owner_id()
+
 st.title('Speech2Text')
 st.subheader('Transkribieren Sie Podcasts oder Sprachaufnahmen.')
-uploaded_file = st.file_uploader("Laden Sie hier Ihre MP3 hoch:", type="mp3")
+uploaded_files = st.file_uploader("Laden Sie hier Ihre MP3s hoch:", type="mp3", accept_multiple_files=True)
+# Zur Auswahl stehen nur die vom Administrator freigegebenen Modelle (WHISPER_ALLOWED_MODELS)
+col1, col2 = st.columns([1, 1])
+with col1:
+    model_size = st.selectbox("Modellgröße:", WHISPER_ALLOWED_MODEL_SIZES,
+                              index=WHISPER_ALLOWED_MODEL_SIZES.index(WHISPER_MODEL_SIZE)
+                              if WHISPER_MODEL_SIZE in WHISPER_ALLOWED_MODEL_SIZES else 0,
+                              disabled=len(WHISPER_ALLOWED_MODEL_SIZES) == 1)
+with col2:
+    compute_type = st.selectbox("Genauigkeit:", WHISPER_ALLOWED_COMPUTE_TYPES,
+                                index=WHISPER_ALLOWED_COMPUTE_TYPES.index(WHISPER_COMPUTE_TYPE)
+                                if WHISPER_COMPUTE_TYPE in WHISPER_ALLOWED_COMPUTE_TYPES else 0,
+                                disabled=len(WHISPER_ALLOWED_COMPUTE_TYPES) == 1)
 
 if st.button('Transkription starten!'):
-    if uploaded_file is not None:
-        file_path = save_uploaded_file(uploaded_file)
-        if file_path:
-            with st.spinner('Transkription läuft...'):
-                full_text = transcribe_podcast_faster(file_path)
-                st.success('Transkription abgeschlossen!')
-                st.code(full_text, language="python")
-        else:
-            st.error("Fehler beim Hochladen der Datei.")
+    if uploaded_files:
+        for uploaded_file in uploaded_files:
+            file_path = save_uploaded_file(uploaded_file)
+            if file_path:
+                submit_transcription_job(owner, uploaded_file.name, file_path, model_size, compute_type)
+            else:
+                st.error(f"Fehler beim Hochladen der Datei {uploaded_file.name}.")
     else:
         st.warning("Bitte lade eine MP3-Datei hoch.")
 
-add_menu()
\ No newline at end of file
+jobs = db.list_transcription_jobs(owner)
+if jobs:
+    st.subheader("Aufträge")
+    st.button("Aktualisieren")
+    for job in jobs:
+        display_job(job, owner)
+
+add_menu()
+
+# Solange Aufträge laufen, die Seite regelmäßig neu laden, um den Fortschritt anzuzeigen
+if any(job["status"] in ("queued", "running") for job in jobs):
+    schedule_refresh(JOB_REFRESH_SECONDS)
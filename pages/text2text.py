@@ -1,19 +1,29 @@
-import os
-from openai import OpenAI
+import hashlib
+import logging
 import database as db
 import streamlit as st
 from dotenv import load_dotenv
-import anthropic
-from mistralai.client import MistralClient
-from vector import list_collections, query_collection
+from providers import ChatStream, get_provider
+from stream_renderer import render_stream, get_stream_metrics
+from vector import list_collections, query_collection, create_embedding, get_collection_version
+from response_cache import response_cache, replay_stream, RESPONSE_CACHE_MAX_TEMPERATURE
+from prompt_builder import build_prompt
 from home import add_menu
 import toml
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+logger = logging.getLogger(__name__)
+
+# Anzahl der abgerufenen Chunks, aus denen der Prompt-Builder auswählt
+RETRIEVAL_CANDIDATES = 8
+# Anzahl der angezeigten Nachrichten, ältere werden auf Wunsch nachgeladen
+HISTORY_WINDOW = 20
+# Höchstzahl an Nachrichten, die dem Prompt-Builder als Verlauf übergeben werden
+PROMPT_HISTORY_MESSAGES = 50
+
+db.setup_database(db.db_name)
+db.setup_conversations()
 
 # Lese die config.toml Datei
 config = toml.load(".streamlit/config.toml")
@@ -23,10 +33,6 @@ anthropic_model = config["server"]["anthropic_model"]
 mistral_model = config["server"]["mistral_model"]
 openai_model = config["server"]["openai_model"]
 
-openai_client = OpenAI()
-anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-mistral_client = MistralClient(api_key=MISTRAL_API_KEY)
-
 st.set_page_config(
     page_title="Luminis - KI-Labor und Lernplattform",
     page_icon="🥼",
@@ -43,17 +49,32 @@ def initialize_session_state():
     """
     if "ai_model" not in st.session_state:
         st.session_state["ai_model"] = openai_model
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    if "conversation_id" not in st.session_state:
+        # Die ID steht in der URL, damit der Chat nach einem Neuladen fortgesetzt werden kann
+        conversation_id = st.query_params.get("chat")
+        if not conversation_id or not db.conversation_exists(conversation_id):
+            conversation_id = db.create_conversation()
+        st.session_state.conversation_id = conversation_id
+        st.session_state.history_window = HISTORY_WINDOW
+    st.query_params["chat"] = st.session_state.conversation_id
+
+def start_new_conversation():
+    """
+    Beginnt einen neuen, leeren Chat.
+    """
+    st.session_state.conversation_id = db.create_conversation()
+    st.session_state.history_window = HISTORY_WINDOW
 
 def display_chat_history():
     """
-    Zeigt den Chatverlauf an.
+    Zeigt die neuesten Nachrichten des Chatverlaufs an, ältere werden auf Wunsch nachgeladen.
     """
-    for message in st.session_state.messages:
-        if message["role"] != "system":
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
+    if db.count_messages(st.session_state.conversation_id) > st.session_state.history_window:
+        if st.button("Ältere Nachrichten laden"):
+            st.session_state.history_window += HISTORY_WINDOW
+    for message in db.get_recent_messages(st.session_state.conversation_id, st.session_state.history_window):
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
 
 def process_user_input(prompt):
     """
@@ -61,64 +82,78 @@ def process_user_input(prompt):
     :param prompt: Die Benutzereingabe.
     :return: Die generierte KI-Antwort.
     """
-    st.session_state.messages.append({"role": "user", "content": prompt})
     with st.chat_message("user"):
         st.markdown(prompt)
 
+    history = db.get_recent_messages(st.session_state.conversation_id, PROMPT_HISTORY_MESSAGES)
+
     with st.chat_message("assistant"):
-        results = query_collection(prompt, st.session_state.collection_to_talk)
-
-        context = "\n".join(results["documents"][0])
-        clean_context = context.strip()
-        print(clean_context)
-
-        if st.session_state["ai_model"] == openai_model:
-            st.session_state.messages.append({"role": "system", "content": st.session_state.primer})
-            stream = openai_client.chat.completions.create(
-                model=openai_model,
-                messages=[
-                    {"role": m["role"], "content": m["content"] + "Greife zur Beantwortung der Frage auf die folgenden Informationen zurück" + clean_context}
-                    for m in st.session_state.messages
-                ],
-                stream=True,
-                temperature=st.session_state.temperature,
-                max_tokens=st.session_state.response_tokens,
+        results = query_collection(prompt, st.session_state.collection_to_talk, RETRIEVAL_CANDIDATES)
+
+        # Primer, Kontext und Verlauf werden in das Token-Budget des Modells eingepasst
+        built_prompt = build_prompt(
+            st.session_state["ai_model"],
+            st.session_state.primer,
+            history,
+            prompt,
+            results["documents"][0],
+            st.session_state.response_tokens,
+            results.get("ids", [[]])[0],
+        )
+        logger.debug("Prompt: %s Tokens, %s Chunks", built_prompt["prompt_tokens"], built_prompt["documents_used"])
+        if built_prompt["primer_truncated"]:
+            st.warning("Die Rollenbeschreibung ist für das Kontextfenster des Modells zu lang und wurde gekürzt.")
+        db.add_message(st.session_state.conversation_id, "user", prompt)
+
+        # Semantischer Antwort-Cache: nur auf Wunsch, bei niedriger Temperatur und ohne vorherigen Verlauf
+        cache_key = None
+        cached_answer = None
+        if (st.session_state.use_response_cache and not history and prompt.strip()
+                and st.session_state.temperature <= RESPONSE_CACHE_MAX_TEMPERATURE):
+            query_embedding = results.get("query_embeddings", [None])[0] or create_embedding(prompt)
+            # Primer und Ausgabelänge gehören zum Schlüssel, damit geänderte Rollen und
+            # abgeschnittene Antworten nicht wiederverwendet werden
+            cache_key = (
+                st.session_state.selected_role_name,
+                hashlib.sha256(built_prompt["system"].encode("utf-8")).hexdigest(),
+                st.session_state.response_tokens,
+                st.session_state["ai_model"],
+                st.session_state.collection_to_talk,
+                get_collection_version(st.session_state.collection_to_talk),
+                tuple(built_prompt["document_ids"]),
             )
-            response = st.write_stream(stream)
-        elif st.session_state["ai_model"] == anthropic_model:
-            with anthropic_client.messages.stream(
-                model=anthropic_model,
-                system=st.session_state.primer,
-                messages=[
-                    {"role": m["role"], "content": m["content"] + context}
-                    for m in st.session_state.messages if m["role"] != "system"
-                ],
-                temperature=st.session_state.temperature,
-                max_tokens=st.session_state.response_tokens,
-            ) as stream:
-                response_container = st.empty()
-                response = ""
-                for text in stream.text_stream:
-                    response += text
-                    response_container.write(response)
-        elif st.session_state["ai_model"] == mistral_model:
-            st.session_state.messages.append({"role": "system", "content": st.session_state.primer})
-            stream_response = mistral_client.chat_stream(
-                model=mistral_model,
-                messages=[
-                    {"role": m["role"], "content": m["content"] + context}
-                    for m in st.session_state.messages
-                ],
-                temperature=st.session_state.temperature,
-                max_tokens=st.session_state.response_tokens,
+            cached_answer = response_cache.get(cache_key, query_embedding)
+
+        # Eine evtl. noch laufende Antwort dieser Session wird abgebrochen
+        if st.session_state.get("active_stream"):
+            st.session_state.active_stream.cancel()
+        response_container = st.container()
+        if cached_answer is not None:
+            response, metrics = render_stream(replay_stream(cached_answer), response_container, "cache", st.session_state["ai_model"])
+            st.caption("Antwort aus dem Cache")
+        else:
+            stream = ChatStream(
+                st.session_state["ai_model"],
+                built_prompt["system"],
+                built_prompt["messages"],
+                st.session_state.temperature,
+                st.session_state.response_tokens,
             )
-            response_container = st.empty()
-            response = ""
-            for text in stream_response:
-                response += text.choices[0].delta.content
-                response_container.write(response)
+            st.session_state.active_stream = stream
+            try:
+                response, metrics = render_stream(stream, response_container, get_provider(st.session_state["ai_model"]), st.session_state["ai_model"])
+                st.caption(f"Erstes Token nach {metrics['time_to_first_token']:.1f} s · "
+                           f"{metrics['tokens_per_second']:.0f} Tokens/s · gesamt {metrics['total_latency']:.1f} s")
+                if cache_key and response:
+                    response_cache.put(cache_key, query_embedding, response)
+            except Exception as e:
+                st.error(f"Die Anfrage an {st.session_state['ai_model']} ist fehlgeschlagen: {e}")
+                response = ""
+            finally:
+                st.session_state.active_stream = None
 
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        if response:
+            db.add_message(st.session_state.conversation_id, "assistant", response)
         return response
 
 def main():
@@ -142,9 +177,10 @@ def main():
             placeholder="Wähle Rollenbeschreibung",
             index=0
         )
-        if st.session_state.selected_role_name:
-            st.session_state.primer = db.get_description_by_name(st.session_state.selected_role_name)
-            st.session_state.aimodel = db.get_aimodel_by_name(st.session_state.selected_role_name)
+        role = db.get_role(st.session_state.selected_role_name) if st.session_state.selected_role_name else None
+        if role:
+            st.session_state.primer = role["description"]
+            st.session_state.aimodel = role["ai_model"]
             st.session_state["ai_model"] = st.session_state.aimodel
 
     with col4:
@@ -154,6 +190,17 @@ def main():
             index=0
         )
 
+    st.session_state.use_response_cache = st.toggle(
+        'Antwort-Cache verwenden',
+        value=False,
+        help='Beantwortet sehr ähnliche Fragen an dieselbe Rolle und Dokumenten-Sammlung aus dem Cache. Gilt nur für die erste Frage eines Chats und bei niedriger Kreativität.'
+    )
+
+    st.button("Neuer Chat", on_click=start_new_conversation)
+
+    with st.expander("Antwortzeiten je Modell"):
+        st.dataframe(get_stream_metrics(), hide_index=True)
+
     st.divider()
 
     display_chat_history()
@@ -1,14 +1,9 @@
-import requests
-import json
 import os
-import time
-from dotenv import load_dotenv
+import uuid
 import streamlit as st
-from home import add_menu
-
-load_dotenv()
-
-HEYGEN_API_KEY = os.getenv('HEYGEN_API_KEY')
+import database as db
+from home import add_menu, schedule_refresh
+from video_jobs import FINAL_STATUSES, start_video_poller, submit_video
 
 st.set_page_config(
     page_title="Luminis - KI-Labor und Lernplattform",
@@ -17,69 +12,35 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-def create_video(text):
-    url = 'https://api.heygen.com/v2/video/generate'
-    headers = {
-        'X-Api-Key': HEYGEN_API_KEY,
-        'Content-Type': 'application/json',
-    }
-    data = {
-      "video_inputs": [
-        {
-          "character": {
-            "type": "avatar",
-            "avatar_id": "Daisy-inskirt-20220818",
-            "avatar_style": "normal"
-          },
-          "voice": {
-            "type": "text",
-            "input_text": text,
-            "voice_id": "2d5b0e6cf36f460aa7fc47e3eee4ba54"
-          },
-          "background": {
-            "type": "color",
-            "value": "#008000"
-          }
-        }
-      ],
-      "dimension": {
-        "width": 1280,
-        "height": 720
-      },
-      "aspect_ratio": "16:9",
-      "test": True
-    }
-
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    if response.status_code == 200:
-        video_id = response.json()["data"]["video_id"]
-        return video_id
-    return None
+# Abstand in Sekunden, in dem die Seite bei laufenden Videos neu geladen wird
+VIDEO_REFRESH_SECONDS = float(os.getenv("VIDEO_REFRESH_SECONDS", 5))
 
+start_video_poller()
 
-def check_video_status(video_id):
-    url = f'https://api.heygen.com/v1/video_status.get?video_id={video_id}'
-    headers = {'X-Api-Key': HEYGEN_API_KEY}
 
-    while True:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            status = response.json().get('data', {}).get('status', '')
-            if status == 'completed':
-                return status
-            elif status == 'failed':
-                return status
+def get_owner_id():
+    """Gibt die ID zurück, unter der die Videos dieser Sitzung gespeichert werden (bleibt in der URL erhalten)."""
+    if "video_owner" not in st.session_state:
+        st.session_state.video_owner = st.query_params.get("videos") or uuid.uuid4().hex
+    st.query_params["videos"] = st.session_state.video_owner
+    return st.session_state.video_owner
 
-        time.sleep(30)  # Warte für 30 Sekunden vor dem nächsten Versuch
-
-def get_video_url(video_id):
-    url = f'https://api.heygen.com/v1/video_status.get?video_id={video_id}'
-    headers = {'X-Api-Key': HEYGEN_API_KEY}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        video_url = response.json()["data"]["video_url"]
-        return video_url
+def display_video_job(job, owner):
+    """Zeigt Status und Ergebnis eines Videos an."""
+    with st.container(border=True):
+        st.markdown(f"**{job['title']}**")
+        if job["status"] == "completed" and job["payload"].get("video_url"):
+            st.video(job["payload"]["video_url"])
+        elif job["status"] == "failed":
+            error = job["payload"].get("error") or ""
+            st.error(f"Videoerstellung fehlgeschlagen. {error}".strip())
+        else:
+            st.info(f"Video wird erstellt... (Status: {job['status']}, {job['attempts']} Abfragen)")
+        if job["status"] in FINAL_STATUSES and st.button("Entfernen", key=f"delete_{job['video_id']}"):
+            db.delete_video_job(job["video_id"], owner)
+            st.rerun()
 
+owner = get_owner_id()
 
 st.title('Text2Video')
 st.subheader('Generieren Sie Videos aus Textbeschreibungen inkl. Voiceover.')
@@ -91,27 +52,30 @@ with col1:
     description = st.text_area('Beschreibung des Videos', placeholder='Hier kommt der Text hin, der vorgetragen werden soll.')
     if st.button('Video generieren!'):
         with col2:
-            with st.spinner('Video wird erstellt... Bitte warten.'):
-                video_id = create_video(description)
-                status = check_video_status(video_id)
-                if status == 'completed':
-                    video_url = get_video_url(video_id)
-                    st.video(video_url)
-                elif status == 'failed':
-                    st.error('Videoerstellung fehlgeschlagen.')
+            if submit_video(owner, description, description[:80] or "Video"):
+                st.success('Video wurde beauftragt und erscheint unten, sobald es fertig ist.')
+            else:
+                st.error('Videoerstellung fehlgeschlagen.')
     st.divider()
     st.subheader('Video in diverse Sprachen übersetzen!')
     target_url = st.text_input('Ziel-URL:', 'https://www.example.com')
     target_language = st.selectbox('Sprache wählen:', ['Englisch', 'Spanisch', 'Französisch'])
     if st.button('Video übersetzen!'):
-        video_id = create_video(description)
         with col2:
-            if video_id:
-                with st.spinner('Video wird übersetzt... Bitte warten.'):
-                    status, video_url = check_video_status(video_id)
-                    if status == 'completed':
-                        st.video(video_url)
-                    elif status == 'failed':
-                        st.error('Videübersetzung fehlgeschlagen.')
+            if submit_video(owner, description, f"Übersetzung ({target_language}): {description[:60]}"):
+                st.success('Übersetzung wurde beauftragt und erscheint unten, sobald sie fertig ist.')
+            else:
+                st.error('Videübersetzung fehlgeschlagen.')
+
+jobs = db.list_video_jobs(owner)
+if jobs:
+    st.subheader("Ihre Videos")
+    st.button("Aktualisieren")
+    for job in jobs:
+        display_video_job(job, owner)
+
+add_menu()
 
-add_menu()
\ No newline at end of file
+# Solange Videos erstellt werden, die Seite regelmäßig neu laden, um den Status anzuzeigen
+if any(job["status"] not in FINAL_STATUSES for job in jobs):
+    schedule_refresh(VIDEO_REFRESH_SECONDS)
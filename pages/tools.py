@@ -1,8 +1,10 @@
 import streamlit as st
-from fpdf import FPDF
 import fitz  # PyMuPDF
+from functools import lru_cache
+from itertools import accumulate
 from home import add_menu
-from vector import count_tokens, convert_pdf_to_string
+from pdf_pipeline import get_encoding, iter_pdf_pages
+from vector import hash_file_content
 import io
 import os
 
@@ -13,6 +15,14 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Anzahl der Seitenindizes, die prozessweit im Cache gehalten werden
+SEITENINDEX_MAX_EINTRAEGE = int(os.getenv("PDF_PAGE_INDEX_MAX_ENTRIES", 32))
+# Seitenlayout für Text2PDF (A4 in Punkten)
+SCHRIFTART_PFAD = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fonts', 'DejaVuSansCondensed.ttf'))
+SCHRIFTGROESSE = 12
+ZEILENHOEHE = 16
+SEITENRAND = 40
+
 st.title('Tools')
 st.subheader('Hier finden Sie Tools, die Ihnen bei der Arbeit mit KI helfen können.')
 
@@ -30,23 +40,65 @@ def pruefe_seitenbereich(start_seite, ende_seite):
         return False
     return True
 
-def pdf_zu_text(datei_bytes, start_seite, ende_seite):
+@st.cache_resource(max_entries=SEITENINDEX_MAX_EINTRAEGE, show_spinner="PDF wird indexiert...")
+def erstelle_seitenindex(inhalt_hash, _datei):
+    """
+    Liest ein PDF-Dokument einmal und erstellt einen Index über seine Seiten.
+    Der Cache wird über den Inhalts-Hash adressiert, die Datei selbst wird nicht gehasht und nur bei
+    einem Fehlzugriff gelesen. cache_resource gibt bei Treffern dasselbe Objekt zurück, statt es wie
+    cache_data jedes Mal zu deserialisieren; der Index darf deshalb nicht verändert werden.
+    :param inhalt_hash: SHA-256 Hash des Dokuments.
+    :param _datei: Die hochgeladene Datei aus st.file_uploader.
+    :return: Dictionary mit dem Gesamttext, den Textanfängen der Seiten ("offsets", eine Position mehr
+             als Seiten) und den aufsummierten Token pro Seite ("token_summen", beginnend mit 0).
+    """
+    seiten = [text for _, text in iter_pdf_pages(_datei.getvalue())]
+    token_pro_seite = [len(tokens) for tokens in get_encoding().encode_ordinary_batch(seiten)]
+    return {
+        "text": ''.join(seiten),
+        "offsets": list(accumulate((len(seite) for seite in seiten), initial=0)),
+        "token_summen": list(accumulate(token_pro_seite, initial=0)),
+    }
+
+def hole_seitenindex(hochgeladene_datei):
+    """
+    Gibt den Seitenindex einer hochgeladenen Datei zurück.
+    Der Inhalts-Hash wird pro Upload in der Session gemerkt, damit die Datei nicht bei jedem Rerun
+    gelesen und gehasht wird.
+    :param hochgeladene_datei: Die hochgeladene Datei aus st.file_uploader.
+    :return: Seitenindex, siehe erstelle_seitenindex.
+    """
+    hashes = st.session_state.setdefault("pdf_hashes", {})
+    if hochgeladene_datei.file_id not in hashes:
+        hashes[hochgeladene_datei.file_id] = hash_file_content(hochgeladene_datei.getvalue())
+    return erstelle_seitenindex(hashes[hochgeladene_datei.file_id], hochgeladene_datei)
+
+def zaehle_token(seitenindex, start_seite, ende_seite):
+    """
+    Ermittelt die Anzahl der Token zwischen den angegebenen Seiten aus den aufsummierten Token pro Seite.
+    Die Token werden pro Seite gezählt, an Seitengrenzen kann die Summe minimal von einer Zählung des
+    zusammenhängenden Textes abweichen.
+    :param seitenindex: Der Seitenindex des Dokuments.
+    :param start_seite: Die Startseite des Bereichs.
+    :param ende_seite: Die Endseite des Bereichs.
+    :return: Anzahl der Token.
+    """
+    token_summen = seitenindex["token_summen"]
+    return token_summen[ende_seite] - token_summen[start_seite - 1]
+
+def pdf_zu_text(seitenindex, start_seite, ende_seite):
     """
     Extrahiert Text aus einem PDF-Dokument zwischen den angegebenen Seiten.
-    :param datei_bytes: Die Bytes des PDF-Dokuments.
+    :param seitenindex: Der Seitenindex des Dokuments.
     :param start_seite: Die Startseite des Bereichs.
     :param ende_seite: Die Endseite des Bereichs.
     :return: Extrahierter Text als String.
     """
-    with fitz.open(stream=datei_bytes, filetype="pdf") as doc:
-        text = ''
-        # Begrenze den Seitenbereich auf die Anzahl der Seiten im Dokument
-        start_seite = max(1, start_seite)
-        ende_seite = min(len(doc), ende_seite)
-        for seitennummer in range(start_seite - 1, ende_seite):
-            seite = doc.load_page(seitennummer)
-            text += seite.get_text()
-    return text
+    offsets = seitenindex["offsets"]
+    # Begrenze den Seitenbereich auf die Anzahl der Seiten im Dokument
+    start_seite = max(1, start_seite)
+    ende_seite = min(len(offsets) - 1, ende_seite)
+    return seitenindex["text"][offsets[start_seite - 1]:offsets[ende_seite]]
 
 def extrahiere_seitenbereich_als_pdf(datei_bytes, start_seite, ende_seite):
     """
@@ -70,34 +122,77 @@ def extrahiere_seitenbereich_als_pdf(datei_bytes, start_seite, ende_seite):
         neues_doc.close()
     return pdf_output
 
+@lru_cache(maxsize=None)
+def lade_schriftart():
+    """
+    Lädt die DejaVu-Schriftart einmal pro Prozess.
+    :return: fitz.Font-Objekt der Schriftart.
+    """
+    return fitz.Font(fontfile=SCHRIFTART_PFAD)
+
+def umbreche_text(text, schriftart, breite):
+    """
+    Bricht den Text zeilenweise auf die angegebene Breite um.
+    :param text: Der umzubrechende Text.
+    :param schriftart: Die Schriftart, mit der die Breite gemessen wird.
+    :param breite: Die verfügbare Zeilenbreite in Punkten.
+    :return: Generator über die einzelnen Zeilen.
+    """
+    leerzeichen_breite = schriftart.text_length(" ", SCHRIFTGROESSE)
+    for absatz in text.splitlines():
+        zeile = ""
+        zeilen_breite = 0
+        for wort in absatz.split(" "):
+            wort_breite = schriftart.text_length(wort, SCHRIFTGROESSE)
+            if zeile and zeilen_breite + leerzeichen_breite + wort_breite <= breite:
+                zeile += " " + wort
+                zeilen_breite += leerzeichen_breite + wort_breite
+                continue
+            if zeile:
+                yield zeile
+            # Wörter, die breiter als eine Zeile sind, werden zeichenweise getrennt
+            while wort_breite > breite:
+                teil = wort
+                while len(teil) > 1 and schriftart.text_length(teil, SCHRIFTGROESSE) > breite:
+                    teil = teil[:len(teil) * 3 // 4]
+                yield teil
+                wort = wort[len(teil):]
+                wort_breite = schriftart.text_length(wort, SCHRIFTGROESSE)
+            zeile = wort
+            zeilen_breite = wort_breite
+        yield zeile
+
 def text_zu_pdf(text):
     """
-    Konvertiert den gegebenen Text in ein PDF-Dokument.
+    Konvertiert den gegebenen Text im Speicher in ein PDF-Dokument.
+    Die Seiten werden nacheinander aus dem umgebrochenen Text erzeugt, auch sehr lange Texte werden
+    so in einem Durchgang verarbeitet.
     :param text: Der zu konvertierende Text.
     :return: BytesIO-Objekt des erstellten PDF-Dokuments.
     """
-    pdf = FPDF()
-    pdf.add_page()
-    # Ermittle den absoluten Pfad zum 'fonts' Verzeichnis, relativ zum aktuellen Skript
-    aktuelles_verzeichnis = os.path.dirname(__file__)
-    schriftarten_pfad = os.path.join(aktuelles_verzeichnis, '..', '..', 'luminis/fonts', 'DejaVuSansCondensed.ttf')
-    schriftarten_pfad = os.path.abspath(schriftarten_pfad)
-    # Füge den Pfad zur Schriftart hinzu
-    pdf.add_font('DejaVu', '', schriftarten_pfad, uni=True)
-    # Verwende die DejaVu Schriftart
-    pdf.set_font('DejaVu', '', 12)
+    schriftart = lade_schriftart()
     # Überprüfe, ob der Text leer ist
-    if text.strip():
-        pdf.multi_cell(0, 10, text)
-    else:
-        pdf.cell(0, 10, "Kein Text vorhanden.")
-    # Speichere das PDF direkt in einer Datei
-    pdf.output("output.pdf")
-    # Öffne die PDF-Datei im Binärmodus und lies den Inhalt
-    with open("output.pdf", "rb") as file:
-        pdf_bytes = file.read()
-    # Erstelle ein BytesIO-Objekt aus den gelesenen Bytes
-    pdf_output = io.BytesIO(pdf_bytes)
+    if not text.strip():
+        text = "Kein Text vorhanden."
+    breite, hoehe = fitz.paper_size("a4")
+    zeilen_pro_seite = int((hoehe - 2 * SEITENRAND) // ZEILENHOEHE)
+    with fitz.open() as doc:
+        zeilen = umbreche_text(text, schriftart, breite - 2 * SEITENRAND)
+        seite = None
+        for index, zeile in enumerate(zeilen):
+            zeilennummer = index % zeilen_pro_seite
+            if zeilennummer == 0:
+                if seite is not None:
+                    schreiber.write_text(seite)
+                seite = doc.new_page(width=breite, height=hoehe)
+                schreiber = fitz.TextWriter(seite.rect)
+            if zeile:
+                schreiber.append((SEITENRAND, SEITENRAND + SCHRIFTGROESSE + zeilennummer * ZEILENHOEHE), zeile,
+                                 font=schriftart, fontsize=SCHRIFTGROESSE)
+        schreiber.write_text(seite)
+        # Nur die verwendeten Zeichen der Schriftart einbetten
+        doc.subset_fonts()
+        pdf_output = io.BytesIO(doc.tobytes(garbage=3, deflate=True))
     return pdf_output
 
 def generiere_dateiname_pdf_bereich(datei_name, start_seite, ende_seite):
@@ -139,20 +234,18 @@ def main():
     hochgeladene_datei = st.file_uploader("Wähle ein PDF-Dokument aus:", type="pdf")
     if hochgeladene_datei is not None:
         try:
-            # Lese die Bytes des hochgeladenen Dokuments
-            datei_bytes = hochgeladene_datei.getvalue()
-            # Anzahl der Seiten und Token im PDF ermitteln
-            with fitz.open(stream=datei_bytes, filetype="pdf") as doc:
-                text = convert_pdf_to_string(datei_bytes)
-                gesamt_seiten = len(doc)
-                gesamt_token = count_tokens(text)
+            # Seiten und Token werden einmal pro Dokument indexiert
+            seitenindex = hole_seitenindex(hochgeladene_datei)
+            gesamt_seiten = len(seitenindex["offsets"]) - 1
+            gesamt_token = seitenindex["token_summen"][-1]
             st.write(f"Das Dokument hat {gesamt_seiten} Seiten und {gesamt_token} Token.")
             # Seitenbereich Auswahl
             start_seite1 = st.number_input("Startseite:", min_value=1, max_value=gesamt_seiten, value=1)
             ende_seite1 = st.number_input("Endseite:", min_value=1, max_value=gesamt_seiten, value=gesamt_seiten)
             if pruefe_seitenbereich(start_seite1, ende_seite1):
+                st.write(f"Der gewählte Bereich enthält {zaehle_token(seitenindex, start_seite1, ende_seite1)} Token.")
                 if st.button("Text extrahieren!"):
-                    text = pdf_zu_text(datei_bytes, start_seite1, ende_seite1)
+                    text = pdf_zu_text(seitenindex, start_seite1, ende_seite1)
                     # Entfernen überflüssiger Leerzeichen und Zeilenumbrüche
                     text = ' '.join(text.split())
                     st.text_area("Text", text, height=400, max_chars=None)
@@ -0,0 +1,175 @@
+import os
+import re
+import multiprocessing
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import fitz
+import tiktoken
+
+# Seiten pro Aufgabe im Prozess-Pool, große Dateien werden in mehrere Bereiche aufgeteilt
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 50))
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", os.cpu_count() or 1))
+# Seitenbereiche, die gleichzeitig im Pool liegen dürfen, damit nie alle Seitentexte im Speicher landen
+PDF_PREFETCH_TASKS = max(1, int(os.getenv("PDF_PREFETCH_TASKS", 2 * PDF_EXTRACTION_WORKERS)))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """Gibt den Tokenizer zurück, der nur einmal pro Prozess geladen wird."""
+    return tiktoken.encoding_for_model("gpt-4-0125-preview")
+
+
+def iter_pdf_pages(source, start_page=1, end_page=None):
+    """
+    Liefert die Seiten einer PDF-Datei (Bytes oder Dateipfad) einzeln als Tupel aus (Seitennummer, Text).
+    Seitennummern beginnen bei 1, der Bereich wird auf die vorhandenen Seiten begrenzt.
+    """
+    with (fitz.open(stream=source, filetype="pdf") if isinstance(source, bytes) else fitz.open(source)) as doc:
+        start_page = max(1, start_page)
+        end_page = len(doc) if end_page is None else min(len(doc), end_page)
+        for page_number in range(start_page - 1, end_page):
+            yield page_number + 1, doc.load_page(page_number).get_text()
+
+
+def normalize_page_text(text):
+    """Fügt Silbentrennungen am Zeilenende zusammen und reduziert Leerraum auf einzelne Leerzeichen."""
+    text = re.sub(r'(\w)-\n(\w)', r'\1\2', text)
+    return ' '.join(text.split())
+
+
+def iter_token_chunks(pages, max_tokens_per_chunk):
+    """
+    Zerlegt einen Strom von Seiten in Chunks mit höchstens max_tokens_per_chunk Tokens.
+    Es wird nie mehr als ein Chunk plus eine Seite im Speicher gehalten.
+    Liefert Dictionaries mit dem Chunk-Text und dem Seitenbereich (page_start, page_end).
+    """
+    encoding = get_encoding()
+    tokens = []
+    # Leseposition im Puffer, verbrauchte Tokens werden erst nach jeder Seite auf einmal entfernt
+    offset = 0
+    # Seitenherkunft der gepufferten Tokens als [Seitennummer, Anzahl Tokens]
+    spans = deque()
+
+    def take(count):
+        page_start = spans[0][0]
+        page_end = page_start
+        remaining = count
+        while remaining:
+            page_end = spans[0][0]
+            if spans[0][1] <= remaining:
+                remaining -= spans.popleft()[1]
+            else:
+                spans[0][1] -= remaining
+                remaining = 0
+        return {"text": encoding.decode(tokens[offset:offset + count]), "page_start": page_start, "page_end": page_end}
+
+    for page_number, text in pages:
+        text = normalize_page_text(text)
+        if not text:
+            continue
+        page_tokens = encoding.encode(text + "\n")
+        tokens.extend(page_tokens)
+        spans.append([page_number, len(page_tokens)])
+        while len(tokens) - offset >= max_tokens_per_chunk:
+            yield take(max_tokens_per_chunk)
+            offset += max_tokens_per_chunk
+        # Es bleibt weniger als ein Chunk übrig, das Entfernen kostet also höchstens max_tokens_per_chunk
+        del tokens[:offset]
+        offset = 0
+    if tokens:
+        yield take(len(tokens))
+
+
+def count_pdf_pages(file_path):
+    """Gibt die Anzahl der Seiten einer PDF-Datei zurück."""
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def extract_page_range(file_path, start_page, end_page):
+    """
+    Extrahiert die normalisierten Texte eines Seitenbereichs, wird in einem Worker-Prozess ausgeführt.
+    Die Datei wird über ihren Pfad geöffnet, damit der Inhalt nicht für jeden Bereich übertragen wird.
+    """
+    return [(page_number, normalize_page_text(text)) for page_number, text in iter_pdf_pages(file_path, start_page, end_page)]
+
+
+def get_process_pool():
+    """Gibt den prozessweiten Pool für die PDF-Verarbeitung zurück und legt ihn beim ersten Aufruf an."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn statt fork, damit die Worker keine Threads und Verbindungen des Streamlit-Prozesses erben
+            _process_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def extract_chunks_parallel(files, max_tokens_per_chunk, on_progress=None):
+    """
+    Extrahiert mehrere PDF-Dateien im Prozess-Pool und zerlegt sie in Chunks.
+    Jede Datei wird einmal in eine temporäre Datei geschrieben, die Worker extrahieren Seitenbereiche
+    daraus. Es laufen höchstens PDF_PREFETCH_TASKS Bereiche gleichzeitig, auch über Dateigrenzen hinweg.
+    Das Chunking läuft im aufrufenden Prozess über alle Bereiche einer Datei hinweg, die Chunks
+    hängen daher nicht von PDF_PAGES_PER_TASK ab.
+    :param files: Liste von PDF-Dateien als Bytes.
+    :param on_progress: Optionale Funktion (Index, fertige Bereiche, alle Bereiche), die bei jedem fertigen Bereich aufgerufen wird.
+    :return: Generator über Tupel aus (Index der Datei, lazy erzeugte Chunks) in der Reihenfolge der Dateien.
+        Die Chunks einer Datei müssen verbraucht werden, bevor die nächste Datei angefordert wird.
+    """
+    pool = get_process_pool()
+    paths = []
+    try:
+        tasks = []
+        totals = []
+        for index, file_bytes in enumerate(files):
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+                f.write(file_bytes)
+            paths.append(f.name)
+            page_count = count_pdf_pages(f.name)
+            ranges = [(start, min(start + PDF_PAGES_PER_TASK - 1, page_count))
+                      for start in range(1, page_count + 1, PDF_PAGES_PER_TASK)]
+            tasks.extend((index, f.name, start_page, end_page) for start_page, end_page in ranges)
+            totals.append(len(ranges))
+
+        remaining_tasks = iter(tasks)
+        pending = deque()
+
+        def submit_next():
+            while len(pending) < PDF_PREFETCH_TASKS:
+                task = next(remaining_tasks, None)
+                if task is None:
+                    break
+                index, path, start_page, end_page = task
+                pending.append((index, pool.submit(extract_page_range, path, start_page, end_page)))
+
+        def iter_pages(index):
+            done = 0
+            while pending and pending[0][0] == index:
+                _, future = pending.popleft()
+                submit_next()
+                pages = future.result()
+                done += 1
+                if on_progress:
+                    on_progress(index, done, totals[index])
+                yield from pages
+
+        submit_next()
+        for index in range(len(files)):
+            pages = iter_pages(index)
+            yield index, iter_token_chunks(pages, max_tokens_per_chunk)
+            # Nicht verbrauchte Bereiche abschließen, damit die nächste Datei vorne in der Warteschlange steht
+            for _ in pages:
+                pass
+    finally:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,118 @@
+import os
+from pdf_pipeline import get_encoding
+from vector import count_tokens
+
+# Kontextfenster der unterstützten Modelle in Tokens
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4-0125-preview": 128000,
+    "claude-3-opus-20240229": 200000,
+    "mistral-large-latest": 32000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# Obergrenze für Frage, Kontext und Verlauf unabhängig vom Kontextfenster, begrenzt Latenz und Kosten.
+# Der Primer zählt nicht dazu, er ist nur durch das Kontextfenster des Modells begrenzt.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 16000))
+# Anteil des verfügbaren Budgets, den die abgerufenen Chunks höchstens belegen dürfen
+CONTEXT_SHARE = float(os.getenv("PROMPT_CONTEXT_SHARE", 0.5))
+# Anteil des Kontextfensters, den der Primer (Rollenbeschreibung) höchstens belegen darf, längere Primer werden gekürzt
+PRIMER_SHARE = float(os.getenv("PROMPT_PRIMER_SHARE", 0.5))
+# Geschätzter Overhead pro Nachricht (Rolle, Trennzeichen)
+MESSAGE_OVERHEAD_TOKENS = 4
+CONTEXT_INSTRUCTION = "Greife zur Beantwortung der Frage auf die folgenden Informationen zurück:\n"
+
+
+def get_window_budget(model, response_tokens):
+    """Berechnet, wie viele Tokens der gesamte Prompt im Kontextfenster des Modells höchstens belegen darf."""
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(0, context_window - response_tokens)
+
+
+def get_prompt_budget(model, response_tokens, primer_tokens=0):
+    """Berechnet, wie viele Tokens der Prompt einschließlich Primer für das Modell höchstens belegen darf."""
+    return min(get_window_budget(model, response_tokens), primer_tokens + PROMPT_TOKEN_BUDGET)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Kürzt einen Text auf höchstens max_tokens Tokens. Gibt den Text und ob gekürzt wurde zurück."""
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text, False
+    return get_encoding().decode(tokens[:max_tokens]), True
+
+
+def merge_consecutive_roles(messages):
+    """Fasst aufeinanderfolgende Nachrichten derselben Rolle zusammen (die Anthropic-API verlangt Wechsel)."""
+    merged = []
+    for message in messages:
+        if merged and merged[-1]["role"] == message["role"]:
+            merged[-1]["content"] += "\n\n" + message["content"]
+        else:
+            merged.append(dict(message))
+    return merged
+
+
+def build_prompt(model, primer, history, prompt, documents, response_tokens, document_ids=None):
+    """
+    Stellt den Prompt innerhalb des Token-Budgets des Modells zusammen.
+    Der Primer wird separat als System-Prompt zurückgegeben, der Kontext genau einmal an die
+    aktuelle Frage angehängt. Es werden so viele Chunks (in Rangfolge) übernommen, wie in den
+    Kontextanteil passen, der Verlauf füllt den Rest von der neuesten Nachricht rückwärts auf.
+    Der Primer ist nur durch das Kontextfenster begrenzt: Belegt er mehr als PRIMER_SHARE davon oder
+    hätte die Frage daneben keinen Platz mehr, wird er gekürzt.
+    :param history: Bisherige Nachrichten als Dictionaries mit "role" und "content" (ohne System-Nachrichten).
+    :param documents: Abgerufene Chunks, nach Relevanz sortiert.
+    :param document_ids: Optionale IDs der Chunks in derselben Reihenfolge wie documents.
+    :return: Dictionary mit "system", "messages", "documents_used", "document_ids" (IDs der übernommenen
+        Chunks), "prompt_tokens" und "primer_truncated".
+    """
+    window_budget = get_window_budget(model, response_tokens)
+    prompt_tokens = count_tokens(prompt) + 2 * MESSAGE_OVERHEAD_TOKENS
+    primer_budget = max(0, min(int(window_budget * PRIMER_SHARE), window_budget - prompt_tokens))
+    primer, primer_truncated = truncate_to_tokens(primer, primer_budget)
+    primer_tokens = count_tokens(primer)
+    budget = get_prompt_budget(model, response_tokens, primer_tokens)
+    used_tokens = primer_tokens + prompt_tokens
+
+    context_budget = max(0, budget - used_tokens) * CONTEXT_SHARE
+    if document_ids is None:
+        document_ids = [None] * len(documents)
+    context_documents = []
+    context_ids = []
+    context_tokens = 0
+    for document_id, document in zip(document_ids, documents):
+        if not document:
+            continue
+        document_tokens = count_tokens(document) + 1
+        if context_tokens + document_tokens > context_budget:
+            break
+        context_documents.append(document)
+        context_ids.append(document_id)
+        context_tokens += document_tokens
+    if context_documents:
+        context_tokens += count_tokens(CONTEXT_INSTRUCTION)
+        user_content = f"{prompt}\n\n{CONTEXT_INSTRUCTION}" + "\n".join(context_documents)
+    else:
+        user_content = prompt
+    used_tokens += context_tokens
+
+    # Älteste Nachrichten fallen zuerst heraus
+    kept_messages = []
+    for message in reversed(history):
+        message_tokens = count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used_tokens + message_tokens > budget:
+            break
+        kept_messages.append({"role": message["role"], "content": message["content"]})
+        used_tokens += message_tokens
+    kept_messages.reverse()
+    # Der Verlauf muss mit einer Benutzernachricht beginnen (Vorgabe der Anthropic-API)
+    while kept_messages and kept_messages[0]["role"] != "user":
+        used_tokens -= count_tokens(kept_messages.pop(0)["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    return {
+        "system": primer,
+        "messages": merge_consecutive_roles(kept_messages + [{"role": "user", "content": user_content}]),
+        "documents_used": len(context_documents),
+        "document_ids": context_ids,
+        "prompt_tokens": used_tokens,
+        "primer_truncated": primer_truncated,
+    }
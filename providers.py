@@ -0,0 +1,200 @@
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+import anthropic
+import httpx
+import openai
+from dotenv import load_dotenv
+from mistralai.async_client import MistralAsyncClient
+from mistralai.exceptions import MistralConnectionException
+
+load_dotenv()
+
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+# OpenAI und Anthropic lesen OPENAI_BASE_URL bzw. ANTHROPIC_BASE_URL selbst, z.B. für lokale Fake-Server
+MISTRAL_ENDPOINT = os.getenv("MISTRAL_ENDPOINT", "https://api.mistral.ai")
+
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", 60))
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", 3))
+PROVIDER_BACKOFF_SECONDS = float(os.getenv("PROVIDER_BACKOFF_SECONDS", 1))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (
+    asyncio.TimeoutError,
+    httpx.TransportError,
+    openai.APIConnectionError,
+    anthropic.APIConnectionError,
+    MistralConnectionException,
+)
+
+# Die Clients leben im Hintergrund-Event-Loop und werden für alle Requests wiederverwendet
+clients = {}
+event_loop = None
+event_loop_lock = threading.Lock()
+
+
+def get_provider(model):
+    """Ermittelt den Anbieter anhand des Modellnamens."""
+    if model.startswith("claude"):
+        return "anthropic"
+    if model.startswith("mistral"):
+        return "mistral"
+    return "openai"
+
+
+def get_client(provider):
+    """Gibt den wiederverwendbaren Client eines Anbieters zurück (nur im Event-Loop aufrufen)."""
+    if provider not in clients:
+        # Wiederholungen übernimmt stream_chat, damit sie für alle Anbieter gleich ablaufen
+        if provider == "openai":
+            clients[provider] = openai.AsyncOpenAI(timeout=PROVIDER_TIMEOUT, max_retries=0)
+        elif provider == "anthropic":
+            clients[provider] = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, timeout=PROVIDER_TIMEOUT, max_retries=0)
+        elif provider == "mistral":
+            clients[provider] = MistralAsyncClient(api_key=MISTRAL_API_KEY, endpoint=MISTRAL_ENDPOINT,
+                                                   timeout=PROVIDER_TIMEOUT, max_retries=0)
+    return clients[provider]
+
+
+async def stream_openai(model, system, messages, temperature, max_tokens):
+    """Streamt eine Antwort von OpenAI, der System-Prompt wird als erste Nachricht gesendet."""
+    stream = await get_client("openai").chat.completions.create(
+        model=model,
+        messages=[{"role": "system", "content": system}] + messages,
+        stream=True,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Verbindung auch bei Abbruch sofort freigeben
+        await stream.response.aclose()
+
+
+async def stream_anthropic(model, system, messages, temperature, max_tokens):
+    """Streamt eine Antwort von Anthropic, der System-Prompt wird separat übergeben."""
+    async with get_client("anthropic").messages.stream(
+        model=model,
+        system=system,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    ) as stream:
+        async for text in stream.text_stream:
+            yield text
+
+
+async def stream_mistral(model, system, messages, temperature, max_tokens):
+    """Streamt eine Antwort von Mistral, der System-Prompt wird als erste Nachricht gesendet."""
+    async for chunk in get_client("mistral").chat_stream(
+        model=model,
+        messages=[{"role": "system", "content": system}] + messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    ):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+# Für Tests können hier lokale Fake-Anbieter eingetragen werden
+PROVIDERS = {
+    "openai": stream_openai,
+    "anthropic": stream_anthropic,
+    "mistral": stream_mistral,
+}
+
+
+def is_retryable(error):
+    """Prüft, ob ein Fehler vorübergehend ist (Rate-Limit, Serverfehler, Verbindungsabbruch)."""
+    if isinstance(error, RETRY_EXCEPTIONS):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return status in RETRY_STATUS_CODES
+
+
+async def stream_chat(model, system, messages, temperature, max_tokens, provider=None):
+    """
+    Einheitliche asynchrone Streaming-Schnittstelle für alle Anbieter.
+    Bei 429/5xx und Verbindungsfehlern wird mit exponentiellem Backoff wiederholt, solange noch
+    kein Text ausgegeben wurde.
+    :param messages: Nachrichten als Dictionaries mit "role" und "content", ohne System-Prompt.
+    :return: Asynchroner Generator über die Textfragmente der Antwort.
+    """
+    stream_fn = PROVIDERS[provider or get_provider(model)]
+    for attempt in range(PROVIDER_MAX_RETRIES + 1):
+        started = False
+        try:
+            async for text in stream_fn(model, system, messages, temperature, max_tokens):
+                started = True
+                yield text
+            return
+        except Exception as e:
+            if started or attempt == PROVIDER_MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = PROVIDER_BACKOFF_SECONDS * 2 ** attempt + random.uniform(0, PROVIDER_BACKOFF_SECONDS)
+            print(f"Anfrage an {model} fehlgeschlagen ({e}), neuer Versuch in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def get_event_loop():
+    """Gibt den prozessweiten Event-Loop zurück, der in einem Hintergrund-Thread läuft."""
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(target=event_loop.run_forever, name="provider-gateway", daemon=True).start()
+        return event_loop
+
+
+class ChatStream:
+    """
+    Synchroner Iterator über einen Antwort-Stream, der im Hintergrund-Event-Loop läuft.
+    Ermöglicht die Verwendung aus Streamlit-Skripten; cancel() bricht die Anfrage ab.
+    started_at hält den Zeitpunkt der Anfrage fest (time.perf_counter) und dient als Bezug für die Latenzmessung.
+    """
+
+    def __init__(self, model, system, messages, temperature, max_tokens, provider=None):
+        self.started_at = time.perf_counter()
+        self._queue = queue.Queue()
+        self._future = asyncio.run_coroutine_threadsafe(
+            self._pump(stream_chat(model, system, messages, temperature, max_tokens, provider)),
+            get_event_loop()
+        )
+
+    async def _pump(self, stream):
+        try:
+            async for text in stream:
+                self._queue.put(("text", text))
+        except Exception as e:
+            self._queue.put(("error", e))
+        finally:
+            self._queue.put(("done", None))
+
+    def __iter__(self):
+        try:
+            while True:
+                try:
+                    kind, value = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self._future.done() and self._queue.empty():
+                        return
+                    continue
+                if kind == "text":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            # Bricht die Anfrage ab, wenn der Leser vorzeitig aufhört (z.B. neue Eingabe in Streamlit)
+            self.cancel()
+
+    def cancel(self):
+        """Bricht die laufende Anfrage ab."""
+        self._future.cancel()
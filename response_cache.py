@@ -0,0 +1,84 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 500))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+# Mindestähnlichkeit der Frage-Embeddings für einen Treffer
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.95))
+# Oberhalb dieser Temperatur sind Antworten bewusst variabel und werden nicht zwischengespeichert
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", 0.2))
+
+
+class SemanticResponseCache:
+    """
+    Prozessweiter Cache für Chat-Antworten.
+    Ein Eintrag gilt für einen exakten Schlüssel (z.B. Rolle, Modell, Collection-Version, Chunk-IDs)
+    und trifft, wenn das Embedding der neuen Frage ähnlich genug zur gespeicherten Frage ist.
+    Einträge verfallen nach ttl_seconds, bei vollem Cache wird der am längsten ungenutzte entfernt.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, similarity_threshold):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._next_id = 0
+
+    def _remove(self, entry_id):
+        key = self._entries.pop(entry_id)["key"]
+        self._keys[key].discard(entry_id)
+        if not self._keys[key]:
+            del self._keys[key]
+
+    def get(self, key, query_embedding):
+        """Gibt die gespeicherte Antwort zurück oder None, wenn keine ähnliche Frage vorliegt."""
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1
+        now = time.time()
+        with self._lock:
+            best_id = None
+            best_similarity = self.similarity_threshold
+            for entry_id in list(self._keys.get(key, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created"] > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(entry["embedding"] @ query_vector)
+                if similarity >= best_similarity:
+                    best_id = entry_id
+                    best_similarity = similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id]["answer"]
+
+    def put(self, key, query_embedding, answer):
+        """Speichert eine Antwort und entfernt bei Bedarf den am längsten ungenutzten Eintrag."""
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {"key": key, "embedding": query_vector, "answer": answer, "created": time.time()}
+            self._keys.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+
+def replay_stream(answer):
+    """Gibt eine gespeicherte Antwort wortweise als Stream aus."""
+    for piece in re.findall(r'\s*\S+\s*', answer):
+        yield piece
+
+
+response_cache = SemanticResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_SIMILARITY)
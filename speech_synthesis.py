@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+SPEECH_MODEL = os.getenv("SPEECH_MODEL", "tts-1")
+SPEECH_VOICES = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
+# Höchstlänge eines Abschnitts in Zeichen (die API erlaubt 4096), kürzere Abschnitte starten schneller
+SPEECH_SEGMENT_MAX_CHARS = int(os.getenv("SPEECH_SEGMENT_MAX_CHARS", 500))
+# Gleichzeitige Anfragen an die API, gemeinsam für alle Sessions
+SPEECH_MAX_CONCURRENCY = int(os.getenv("SPEECH_MAX_CONCURRENCY", 4))
+# Abschnitte eines Textes, die gleichzeitig angefragt werden, damit lange Texte den Pool nicht für andere blockieren
+SPEECH_MAX_IN_FLIGHT_PER_REQUEST = max(1, int(os.getenv("SPEECH_MAX_IN_FLIGHT_PER_REQUEST", 2)))
+# Obergrenze für den Speicherbedarf des Audio-Caches
+SPEECH_CACHE_MAX_BYTES = int(os.getenv("SPEECH_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?…:;])\s+|\n+')
+
+speech_executor = ThreadPoolExecutor(max_workers=SPEECH_MAX_CONCURRENCY, thread_name_prefix="speech")
+
+
+class SpeechCache:
+    """
+    Prozessweiter LRU-Cache für synthetisierte Abschnitte, begrenzt durch die Gesamtgröße in Bytes.
+    Der Schlüssel besteht aus Modell, Stimme und dem Hash des Textes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def make_key(voice, text):
+        return SPEECH_MODEL, voice, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = audio
+            self.size += len(audio)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+speech_cache = SpeechCache(SPEECH_CACHE_MAX_BYTES)
+
+
+def split_into_segments(text, max_chars=SPEECH_SEGMENT_MAX_CHARS):
+    """
+    Teilt einen Text an Satzgrenzen in Abschnitte von höchstens max_chars Zeichen.
+    Aufeinanderfolgende Sätze werden zusammengefasst, zu lange Sätze an Leerzeichen getrennt.
+    """
+    segments = []
+    current = ""
+    for sentence in SENTENCE_PATTERN.split(text):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                segments.append(current)
+                current = ""
+            segments.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            segments.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+def synthesize_segment(text, voice):
+    """Gibt die MP3-Daten für einen Abschnitt zurück, aus dem Cache oder von der API."""
+    key = SpeechCache.make_key(voice, text)
+    audio = speech_cache.get(key)
+    if audio is None:
+        response = openai.audio.speech.create(model=SPEECH_MODEL, voice=voice, input=text, response_format="mp3")
+        audio = response.content
+        speech_cache.put(key, audio)
+    return audio
+
+
+def iter_speech(text, voice):
+    """
+    Synthetisiert einen Text abschnittsweise und parallel.
+    Pro Text sind höchstens SPEECH_MAX_IN_FLIGHT_PER_REQUEST Abschnitte gleichzeitig in Arbeit, der
+    nächste wird erst angefragt, wenn der älteste ausgegeben wurde. So teilen sich mehrere Nutzer
+    den gemeinsamen Pool, statt dass ein langer Text alle Plätze belegt.
+    Die Abschnitte werden in der richtigen Reihenfolge ausgegeben, sobald sie vorliegen.
+    :return: Generator über die MP3-Daten der einzelnen Abschnitte.
+    """
+    segments = split_into_segments(text)
+    # Wiederholte Abschnitte im selben Text nur einmal anfragen
+    futures = {}
+    submitted = 0
+    try:
+        for position, segment in enumerate(segments):
+            while submitted < min(len(segments), position + SPEECH_MAX_IN_FLIGHT_PER_REQUEST):
+                if segments[submitted] not in futures:
+                    futures[segments[submitted]] = speech_executor.submit(synthesize_segment, segments[submitted], voice)
+                submitted += 1
+            yield futures[segment].result()
+    finally:
+        # Bei Abbruch (z.B. neue Eingabe in Streamlit) noch nicht gestartete Abschnitte verwerfen
+        for future in futures.values():
+            future.cancel()
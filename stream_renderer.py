@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+import time
+from pdf_pipeline import get_encoding
+
+# Maximale Anzahl an Aktualisierungen pro Sekunde während eine Antwort gestreamt wird
+STREAM_MAX_FPS = float(os.getenv("STREAM_MAX_FPS", 10))
+
+# Aggregierte Metriken pro (Anbieter, Modell), gemeinsam für alle Sessions
+stream_metrics = {}
+stream_metrics_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def record_stream_metrics(provider, model, metrics):
+    """Nimmt die Metriken einer Antwort in die Statistik für Anbieter und Modell auf."""
+    with stream_metrics_lock:
+        totals = stream_metrics.setdefault((provider, model), {
+            "responses": 0, "time_to_first_token": 0.0, "tokens_per_second": 0.0, "total_latency": 0.0
+        })
+        totals["responses"] += 1
+        for name in ("time_to_first_token", "tokens_per_second", "total_latency"):
+            totals[name] += metrics[name]
+    logger.info("%s/%s: erstes Token nach %.2fs, %.1f Tokens/s, gesamt %.2fs", provider, model,
+                metrics["time_to_first_token"], metrics["tokens_per_second"], metrics["total_latency"])
+
+
+def get_stream_metrics():
+    """Gibt die Durchschnittswerte pro Anbieter und Modell zurück."""
+    with stream_metrics_lock:
+        return [
+            {
+                "Anbieter": provider,
+                "Modell": model,
+                "Antworten": totals["responses"],
+                "Erstes Token (s)": round(totals["time_to_first_token"] / totals["responses"], 2),
+                "Tokens/s": round(totals["tokens_per_second"] / totals["responses"], 1),
+                "Gesamt (s)": round(totals["total_latency"] / totals["responses"], 2),
+            }
+            for (provider, model), totals in stream_metrics.items()
+        ]
+
+
+def render_stream(stream, container, provider, model, max_fps=STREAM_MAX_FPS):
+    """
+    Zeigt eine gestreamte Antwort an und misst Time-to-First-Token, Tokens pro Sekunde und Gesamtlatenz.
+    Die Antwort wird in einen einzigen Platzhalter geschrieben, damit Listen und Codeblöcke als Ganzes
+    gerendert werden, und höchstens max_fps mal pro Sekunde aktualisiert.
+    Die Zeit wird ab dem Start der Anfrage gemessen, wenn der Stream ihn als started_at mitbringt.
+    :param container: Streamlit-Container, in den die Antwort geschrieben wird.
+    :return: Tupel aus (vollständige Antwort, Metriken).
+    """
+    interval = 1.0 / max_fps
+    start = getattr(stream, "started_at", None) or time.perf_counter()
+    first_token = None
+    last_render = 0.0
+    parts = []
+    placeholder = container.empty()
+    try:
+        for text in stream:
+            if not text:
+                continue
+            now = time.perf_counter()
+            if first_token is None:
+                first_token = now
+            parts.append(text)
+            if now - last_render >= interval:
+                placeholder.markdown("".join(parts) + "▌")
+                last_render = now
+    finally:
+        placeholder.markdown("".join(parts))
+
+    end = time.perf_counter()
+    response = "".join(parts)
+    first_token = first_token or end
+    generation_time = end - first_token
+    token_count = len(get_encoding().encode(response))
+    metrics = {
+        "time_to_first_token": first_token - start,
+        "tokens_per_second": token_count / generation_time if generation_time > 0 else 0.0,
+        "total_latency": end - start,
+        "tokens": token_count,
+    }
+    record_stream_metrics(provider, model, metrics)
+    return response, metrics
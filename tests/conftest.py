@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Die Module liegen flach im Wurzelverzeichnis des Repositories
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Vektorspeicher und Caches der Tests in ein temporäres Verzeichnis legen, bevor vector importiert wird
+TEST_DATA_DIR = tempfile.mkdtemp(prefix="luminis-tests-")
+os.environ.setdefault("CHROMA_PATH", os.path.join(TEST_DATA_DIR, "chroma_db"))
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(TEST_DATA_DIR, "embedding_cache.db"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
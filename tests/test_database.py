@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+import database as db
+
+
+def create_version_1(path, names):
+    conn = sqlite3.connect(path)
+    db.migration_create_roles(conn)
+    conn.executemany('INSERT INTO roles (name, description, ai_model) VALUES (?, ?, ?)',
+                     [(name, f"Beschreibung {index}", "gpt-4") for index, name in enumerate(names)])
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+    conn.close()
+
+
+def test_duplicate_role_names_are_renamed(tmp_path):
+    path = str(tmp_path / "roles.db")
+    create_version_1(path, ["Jurist", "Jurist", "Jurist (2)", "Lektor", "Jurist"])
+
+    db.migrate(path)
+
+    with db.connect_db(path) as c:
+        c.execute('SELECT name, description FROM roles ORDER BY id')
+        roles = c.fetchall()
+        c.execute('PRAGMA user_version')
+        assert c.fetchone()[0] == len(db.MIGRATIONS)
+    assert [name for name, _ in roles] == ["Jurist", "Jurist (3)", "Jurist (2)", "Lektor", "Jurist (4)"]
+    assert [description for _, description in roles] == [f"Beschreibung {index}" for index in range(5)]
+
+
+def test_failed_migration_leaves_schema_and_version_unchanged(tmp_path, monkeypatch):
+    path = str(tmp_path / "roles.db")
+    create_version_1(path, ["Jurist"])
+
+    def broken_migration(c):
+        db.migration_unique_name_and_preview(c)
+        raise RuntimeError("Abbruch nach ALTER TABLE")
+
+    monkeypatch.setattr(db, "MIGRATIONS", [db.migration_create_roles, broken_migration])
+    with pytest.raises(RuntimeError):
+        db.migrate(path)
+
+    with db.connect_db(path) as c:
+        c.execute('PRAGMA user_version')
+        assert c.fetchone()[0] == 1
+        c.execute('PRAGMA table_info(roles)')
+        assert "preview" not in [row[1] for row in c.fetchall()]
+
+    # Der nächste Start führt die Migration vollständig aus
+    monkeypatch.undo()
+    db.migrate(path)
+    with db.connect_db(path) as c:
+        c.execute('PRAGMA user_version')
+        assert c.fetchone()[0] == len(db.MIGRATIONS)
@@ -0,0 +1,110 @@
+import types
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("tiktoken")
+pytest.importorskip("fitz")
+
+import vector
+
+
+def make_records(lengths):
+    return [{"id": str(i), "document": " ".join(["wort"] * length), "metadata": {}} for i, length in enumerate(lengths)]
+
+
+class RecordingRateLimiter:
+    def __init__(self):
+        self.acquired = []
+
+    def acquire(self, tokens):
+        self.acquired.append(tokens)
+
+
+def test_batches_respect_token_and_size_limits():
+    records = make_records([10, 20, 5, 30, 1, 1, 1, 1, 40])
+    batches = list(vector.batch_chunks_by_tokens(records, max_tokens_per_batch=50, max_batch_size=3))
+
+    assert [record for batch, _ in batches for record in batch] == records
+    for batch, batch_tokens in batches:
+        assert len(batch) <= 3
+        assert batch_tokens == sum(vector.count_tokens(record["document"]) for record in batch)
+        # Nur ein einzelner Chunk darf das Token-Limit allein überschreiten
+        assert batch_tokens <= 50 or len(batch) == 1
+
+
+def test_embed_batches_uses_stub_and_rate_limiter():
+    records = make_records([10, 20, 5, 30, 1, 1, 1, 1, 40])
+    batches = list(vector.batch_chunks_by_tokens(records, max_tokens_per_batch=50, max_batch_size=3))
+    limiter = RecordingRateLimiter()
+    calls = []
+
+    def embed_fn(texts):
+        calls.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    results = list(vector.embed_batches(iter(batches), embed_fn=embed_fn, max_concurrency=2, rate_limiter=limiter))
+
+    assert sorted(calls) == sorted(len(batch) for batch, _ in batches)
+    assert sorted(limiter.acquired) == sorted(batch_tokens for _, batch_tokens in batches)
+    for batch, embeddings in results:
+        assert embeddings == [[float(len(record["document"]))] for record in batch]
+    assert sorted(record["id"] for batch, _ in results for record in batch) == sorted(record["id"] for record in records)
+
+
+def test_rate_limiter_waits_until_window_frees_budget(monkeypatch):
+    clock = {"now": 1000.0}
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock["now"] += seconds
+
+    monkeypatch.setattr(vector, "time", types.SimpleNamespace(monotonic=lambda: clock["now"], sleep=sleep))
+    limiter = vector.TokenRateLimiter(100)
+
+    limiter.acquire(60)
+    clock["now"] += 10
+    limiter.acquire(30)
+    assert sleeps == []
+
+    # 60 + 30 + 60 übersteigt das Budget, der erste Eintrag verfällt nach 60 Sekunden
+    limiter.acquire(60)
+    assert sleeps == [pytest.approx(50.0)]
+
+
+def test_rate_limiter_caps_oversized_batches(monkeypatch):
+    monkeypatch.setattr(vector, "time", types.SimpleNamespace(monotonic=lambda: 0.0, sleep=pytest.fail))
+    limiter = vector.TokenRateLimiter(100)
+    # Ein Batch größer als das Budget darf nicht endlos blockieren
+    limiter.acquire(500)
+
+
+def test_cached_texts_are_not_charged_to_rate_limiter(monkeypatch):
+    cached = {"bekannt": [1.0]}
+    requests = []
+
+    class FakeCache:
+        def get_many(self, model, texts):
+            return [cached.get(text) for text in texts]
+
+        def put_many(self, model, texts, embeddings):
+            cached.update(zip(texts, embeddings))
+
+    def create(input, model):
+        requests.append(list(input))
+        return types.SimpleNamespace(data=[types.SimpleNamespace(index=i, embedding=[2.0]) for i in range(len(input))])
+
+    monkeypatch.setattr(vector, "embedding_cache", FakeCache())
+    monkeypatch.setattr(vector, "openai_client", types.SimpleNamespace(embeddings=types.SimpleNamespace(create=create)))
+    limiter = RecordingRateLimiter()
+    records = [{"id": "1", "document": "bekannt", "metadata": {}}]
+
+    # Vollständig gecachte Batches verbrauchen kein Budget und senden keinen Request
+    results = list(vector.embed_batches(iter([(records, 100)]), rate_limiter=limiter))
+    assert results == [(records, [[1.0]])]
+    assert limiter.acquired == [] and requests == []
+
+    records.append({"id": "2", "document": "neuer Text", "metadata": {}})
+    list(vector.embed_batches(iter([(records, 100)]), rate_limiter=limiter))
+    assert requests == [["neuer Text"]]
+    assert limiter.acquired == [vector.count_tokens("neuer Text")]
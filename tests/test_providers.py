@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("anthropic")
+pytest.importorskip("mistralai")
+pytest.importorskip("dotenv")
+
+import providers
+
+
+class FakeStatusError(Exception):
+    """Fehler mit HTTP-Status, wie ihn die SDKs bei 429/5xx auslösen."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(providers, "PROVIDER_BACKOFF_SECONDS", 0)
+
+
+def register(monkeypatch, stream_fn):
+    monkeypatch.setitem(providers.PROVIDERS, "fake", stream_fn)
+
+
+def open_stream():
+    return providers.ChatStream("fake-model", "System", [{"role": "user", "content": "Hallo"}], 0.0, 100, provider="fake")
+
+
+def test_retries_rate_limit_and_server_errors_before_first_token(monkeypatch):
+    attempts = []
+
+    async def fake(model, system, messages, temperature, max_tokens):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise FakeStatusError(429)
+        if len(attempts) == 2:
+            raise FakeStatusError(503)
+        for text in ("Hallo", " Welt"):
+            yield text
+
+    register(monkeypatch, fake)
+    assert "".join(open_stream()) == "Hallo Welt"
+    assert len(attempts) == 3
+
+
+def test_no_retry_after_text_was_emitted(monkeypatch):
+    attempts = []
+
+    async def fake(model, system, messages, temperature, max_tokens):
+        attempts.append(model)
+        yield "Hallo"
+        raise FakeStatusError(503)
+
+    register(monkeypatch, fake)
+    received = []
+    with pytest.raises(FakeStatusError):
+        for text in open_stream():
+            received.append(text)
+    assert received == ["Hallo"]
+    assert len(attempts) == 1
+
+
+def test_errors_propagate_through_chat_stream(monkeypatch):
+    attempts = []
+
+    async def fake(model, system, messages, temperature, max_tokens):
+        attempts.append(model)
+        raise ValueError("ungültige Anfrage")
+        yield
+
+    register(monkeypatch, fake)
+    with pytest.raises(ValueError, match="ungültige Anfrage"):
+        list(open_stream())
+    # Nicht vorübergehende Fehler werden nicht wiederholt
+    assert len(attempts) == 1
+
+
+def test_closing_the_iterator_cancels_the_request(monkeypatch):
+    closed = threading.Event()
+
+    async def fake(model, system, messages, temperature, max_tokens):
+        try:
+            yield "Hallo"
+            # Der Anbieter antwortet nicht weiter, bis die Anfrage abgebrochen wird
+            await asyncio.Event().wait()
+        finally:
+            closed.set()
+
+    register(monkeypatch, fake)
+    iterator = iter(open_stream())
+    assert next(iterator) == "Hallo"
+    iterator.close()
+    assert closed.wait(timeout=5)
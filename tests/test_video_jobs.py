@@ -0,0 +1,125 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+import database as db
+import video_jobs
+
+
+class FakeHeyGen:
+    """Lokaler Ersatz für die HeyGen-API: meldet ein Video erst als "processing", dann als "completed"."""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.generate_requests = []
+        self.status_requests = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                fake.generate_requests.append((self.path, self.headers.get("X-Api-Key"), body))
+                self.send_json(200, {"data": {"video_id": f"video-{len(fake.generate_requests)}"}})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                video_id = parse_qs(url.query)["video_id"][0]
+                fake.status_requests.append((url.path, video_id))
+                code, status = fake.statuses.pop(0) if fake.statuses else (200, "completed")
+                if code != 200:
+                    self.send_json(code, {"error": "unavailable"})
+                    return
+                data = {"status": status}
+                if status == "completed":
+                    data["video_url"] = f"https://videos.example/{video_id}.mp4"
+                self.send_json(200, {"data": data})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def video_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "video_jobs.db")
+    monkeypatch.setattr(db, "videos_db_name", path)
+    db.setup_video_jobs(path)
+    # Sofort erneut abfragen, damit der Test nicht auf den Backoff warten muss
+    monkeypatch.setattr(video_jobs, "VIDEO_POLL_INITIAL_SECONDS", 0)
+    return path
+
+
+def start_fake(monkeypatch, statuses):
+    fake = FakeHeyGen(statuses)
+    monkeypatch.setattr(video_jobs, "HEYGEN_BASE_URL", fake.url)
+    monkeypatch.setitem(video_jobs.session.headers, "X-Api-Key", "test-key")
+    return fake
+
+
+def test_video_is_polled_until_completed(video_db, monkeypatch):
+    with start_fake(monkeypatch, [(200, "pending"), (200, "processing"), (200, "completed")]) as fake:
+        video_id = video_jobs.create_video("Hallo Welt")
+        assert video_id == "video-1"
+        path, api_key, body = fake.generate_requests[0]
+        assert path == "/v2/video/generate"
+        assert api_key == "test-key"
+        assert body["video_inputs"][0]["voice"]["input_text"] == "Hallo Welt"
+
+        db.create_video_job(video_id, "owner", "Titel", 0)
+        for _ in range(3):
+            video_jobs.poll_due_videos()
+        # Fertige Videos werden nicht mehr abgefragt
+        video_jobs.poll_due_videos()
+
+    assert fake.status_requests == [("/v1/video_status.get", "video-1")] * 3
+    job, = db.list_video_jobs("owner")
+    assert job["status"] == "completed"
+    assert job["attempts"] == 3
+    assert job["payload"]["video_url"] == "https://videos.example/video-1.mp4"
+    assert db.get_next_video_poll_time(video_jobs.FINAL_STATUSES) is None
+
+
+def test_failed_status_request_keeps_last_status(video_db, monkeypatch):
+    with start_fake(monkeypatch, [(200, "processing"), (500, None)]):
+        db.create_video_job("video-1", "owner", "Titel", 0)
+        video_jobs.poll_due_videos()
+        video_jobs.poll_due_videos()
+
+    job, = db.list_video_jobs("owner")
+    assert job["status"] == "processing"
+    assert job["attempts"] == 2
+    assert job["payload"] == {"status": "processing"}
+
+
+def test_poll_delay_backs_off_exponentially(monkeypatch):
+    monkeypatch.setattr(video_jobs, "VIDEO_POLL_INITIAL_SECONDS", 5)
+    monkeypatch.setattr(video_jobs, "VIDEO_POLL_MAX_SECONDS", 120)
+    assert [video_jobs.get_poll_delay(attempts) for attempts in range(7)] == [5, 10, 20, 40, 80, 120, 120]
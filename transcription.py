@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import database as db
+
+WHISPER_MODEL_SIZES = ["tiny", "base", "small", "medium", "large-v3"]
+WHISPER_COMPUTE_TYPES = ["int8", "float32"]
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "tiny")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+
+
+def parse_allowed(value, known, default):
+    """Liest eine kommagetrennte Liste aus der Umgebung und behält nur bekannte Einträge."""
+    allowed = [item for item in (part.strip() for part in value.split(",")) if item in known]
+    return allowed or [default]
+
+
+# Modelle und Genauigkeiten, die Nutzer auswählen dürfen (kommagetrennt), standardmäßig nur die konfigurierten
+WHISPER_ALLOWED_MODEL_SIZES = parse_allowed(os.getenv("WHISPER_ALLOWED_MODELS", WHISPER_MODEL_SIZE),
+                                            WHISPER_MODEL_SIZES, WHISPER_MODEL_SIZE)
+WHISPER_ALLOWED_COMPUTE_TYPES = parse_allowed(os.getenv("WHISPER_ALLOWED_COMPUTE_TYPES", WHISPER_COMPUTE_TYPE),
+                                              WHISPER_COMPUTE_TYPES, WHISPER_COMPUTE_TYPE)
+# Ist das konfigurierte Standardmodell nicht freigegeben, gilt das erste freigegebene als Standard,
+# damit Vorladen und Standardwerte nie ein gesperrtes Modell anfordern
+if WHISPER_MODEL_SIZE not in WHISPER_ALLOWED_MODEL_SIZES:
+    WHISPER_MODEL_SIZE = WHISPER_ALLOWED_MODEL_SIZES[0]
+if WHISPER_COMPUTE_TYPE not in WHISPER_ALLOWED_COMPUTE_TYPES:
+    WHISPER_COMPUTE_TYPE = WHISPER_ALLOWED_COMPUTE_TYPES[0]
+# Höchstzahl gleichzeitig geladener Modelle, das am längsten nicht genutzte wird zuerst entladen
+WHISPER_MAX_LOADED_MODELS = max(1, int(os.getenv("WHISPER_MAX_LOADED_MODELS", 2)))
+# Threads pro Worker, 0 überlässt CTranslate2 die Wahl (standardmäßig 4)
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", 0))
+# Anzahl paralleler Transkriptionen, die ein Modell gleichzeitig bearbeiten kann
+WHISPER_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+# Maximale Länge der Abschnitte, die unabhängig voneinander transkribiert werden
+WHISPER_CHUNK_SECONDS = float(os.getenv("WHISPER_CHUNK_SECONDS", 30))
+# Mindestlänge einer Pause, an der die Aufnahme geschnitten werden darf
+WHISPER_MIN_SILENCE_MS = int(os.getenv("WHISPER_MIN_SILENCE_MS", 500))
+SAMPLING_RATE = 16000
+# Anzahl der Aufträge, die gleichzeitig transkribiert werden; weitere Aufträge warten in der Warteschlange
+TRANSCRIPTION_JOB_WORKERS = int(os.getenv("TRANSCRIPTION_JOB_WORKERS", 1))
+
+# Prozessweite Registry der geladenen Modelle (LRU), gemeinsam für alle Sessions
+models = OrderedDict()
+model_load_times = {}
+model_locks = {}
+registry_lock = threading.Lock()
+warm_up_thread = None
+job_workers = []
+job_available = threading.Event()
+
+
+def get_model(model_size=WHISPER_MODEL_SIZE, compute_type=WHISPER_COMPUTE_TYPE):
+    """
+    Gibt das Whisper-Modell zurück und lädt es beim ersten Zugriff im Prozess.
+    Nur freigegebene Modelle werden geladen; sind mehr als WHISPER_MAX_LOADED_MODELS geladen,
+    wird das am längsten nicht genutzte aus der Registry entfernt.
+    """
+    if model_size not in WHISPER_ALLOWED_MODEL_SIZES or compute_type not in WHISPER_ALLOWED_COMPUTE_TYPES:
+        raise ValueError(f"Das Whisper-Modell '{model_size}' ({compute_type}) ist nicht freigegeben.")
+    key = (model_size, compute_type)
+    with registry_lock:
+        lock = model_locks.setdefault(key, threading.Lock())
+    # Pro Modell sperren, damit gleichzeitige Anfragen nicht mehrfach laden
+    with lock:
+        with registry_lock:
+            model = models.get(key)
+            if model is not None:
+                models.move_to_end(key)
+                return model
+        from faster_whisper import WhisperModel
+        start = time.perf_counter()
+        model = WhisperModel(
+            model_size,
+            device="cpu",
+            compute_type=compute_type,
+            cpu_threads=WHISPER_CPU_THREADS,
+            num_workers=WHISPER_NUM_WORKERS,
+        )
+        model_load_times[key] = time.perf_counter() - start
+        print(f"Whisper-Modell '{model_size}' ({compute_type}) in {model_load_times[key]:.1f}s geladen")
+        with registry_lock:
+            models[key] = model
+            while len(models) > WHISPER_MAX_LOADED_MODELS:
+                # Laufende Transkriptionen behalten ihre Referenz, der Speicher wird danach frei
+                (evicted_size, evicted_type), _ = models.popitem(last=False)
+                print(f"Whisper-Modell '{evicted_size}' ({evicted_type}) entladen")
+        return model
+
+
+def warm_up_models():
+    """Lädt das konfigurierte Modell im Hintergrund und führt eine kurze Probe-Transkription aus."""
+    global warm_up_thread
+
+    def warm_up():
+        import numpy as np
+        model = get_model()
+        # Eine Sekunde Stille genügt, um die Inferenz einmal zu durchlaufen
+        segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1)
+        list(segments)
+
+    with registry_lock:
+        if warm_up_thread is None:
+            warm_up_thread = threading.Thread(target=warm_up, name="whisper-warm-up", daemon=True)
+            warm_up_thread.start()
+
+
+def format_timestamp(seconds):
+    """Formatiert Sekunden als hh:mm:ss."""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def split_at_silences(audio, max_seconds=WHISPER_CHUNK_SECONDS):
+    """
+    Teilt die Aufnahme an den per VAD erkannten Pausen in Abschnitte von höchstens max_seconds.
+    Aufeinanderfolgende Sprachpassagen werden zusammengefasst, solange der Abschnitt nicht zu lang wird.
+    :return: Liste von (Start, Ende) in Samples.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    max_samples = int(max_seconds * SAMPLING_RATE)
+    speech = get_speech_timestamps(audio, VadOptions(
+        min_silence_duration_ms=WHISPER_MIN_SILENCE_MS,
+        max_speech_duration_s=max_seconds,
+    ))
+    pieces = []
+    for span in speech:
+        if pieces and span["end"] - pieces[-1][0] <= max_samples:
+            pieces[-1] = (pieces[-1][0], span["end"])
+        else:
+            pieces.append((span["start"], span["end"]))
+    return pieces
+
+
+def transcribe_piece(model, audio, start, language):
+    """Transkribiert einen Abschnitt und verschiebt die Zeitstempel auf die Position in der Aufnahme."""
+    offset = start / SAMPLING_RATE
+    segments, _ = model.transcribe(audio, beam_size=5, language=language)
+    return [
+        {"start": offset + segment.start, "end": offset + segment.end, "text": segment.text.strip()}
+        for segment in segments
+    ]
+
+
+def iter_transcription(file_path, model_size=WHISPER_MODEL_SIZE, compute_type=WHISPER_COMPUTE_TYPE, timings=None):
+    """
+    Transkribiert eine Aufnahme abschnittsweise und parallel mit dem gemeinsamen Modell.
+    Die Abschnitte werden an Pausen geschnitten und von WHISPER_NUM_WORKERS Threads gleichzeitig
+    dekodiert. Fertige Abschnitte werden in der richtigen Reihenfolge ausgegeben, sobald alle
+    vorherigen Abschnitte fertig sind.
+    :param timings: Optionales Dictionary, in das Ladezeit, Wartezeit und Inferenzzeit geschrieben werden.
+    :return: Generator über Listen von Segmenten (Dictionaries mit "start", "end" und "text") je Abschnitt.
+    """
+    from faster_whisper.audio import decode_audio
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    model = get_model(model_size, compute_type)
+    timings["waited"] = time.perf_counter() - start
+    timings["model_load"] = model_load_times[(model_size, compute_type)]
+
+    start = time.perf_counter()
+    audio = decode_audio(file_path, sampling_rate=SAMPLING_RATE)
+    timings["audio_seconds"] = len(audio) / SAMPLING_RATE
+    pieces = split_at_silences(audio)
+    if pieces:
+        # Sprache einmal bestimmen, damit alle Abschnitte in derselben Sprache transkribiert werden
+        first_start, first_end = pieces[0]
+        _, info = model.transcribe(audio[first_start:first_end])
+        print("Detected language '%s' with probability %f" % (info.language, info.language_probability))
+
+        with ThreadPoolExecutor(max_workers=WHISPER_NUM_WORKERS) as executor:
+            futures = {
+                executor.submit(transcribe_piece, model, audio[piece_start:piece_end], piece_start, info.language): index
+                for index, (piece_start, piece_end) in enumerate(pieces)
+            }
+            finished = {}
+            next_index = 0
+            try:
+                for future in as_completed(futures):
+                    finished[futures[future]] = future.result()
+                    while next_index in finished:
+                        yield finished.pop(next_index)
+                        next_index += 1
+            finally:
+                # Bei Abbruch (z.B. neue Eingabe in Streamlit) keine weiteren Abschnitte starten
+                for future in futures:
+                    future.cancel()
+    timings["inference"] = time.perf_counter() - start
+
+
+def remove_file(file_path):
+    """Entfernt eine hochgeladene Datei, falls sie noch existiert."""
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def run_transcription_job(job):
+    """Transkribiert einen Auftrag und hängt Fortschritt und neue Segmente nach jedem Abschnitt an."""
+    timings = {}
+    position = 0
+    try:
+        for piece in iter_transcription(job["file_path"], job["model_size"], job["compute_type"], timings):
+            if piece:
+                progress = min(1.0, piece[-1]["end"] / timings["audio_seconds"]) if timings["audio_seconds"] else 0.0
+                db.append_transcription_segments(job["id"], position, piece, progress, timings["audio_seconds"])
+                position += len(piece)
+        db.finish_transcription_job(job["id"], timings["audio_seconds"], timings["inference"],
+                                    timings["model_load"], timings["waited"])
+    except Exception as e:
+        traceback.print_exc()
+        db.fail_transcription_job(job["id"], str(e))
+    finally:
+        # Ein fehlgeschlagener Auftrag wird nicht wiederholt, die Datei wird also in keinem Fall mehr gebraucht
+        remove_file(job["file_path"])
+
+
+def transcription_worker():
+    """Arbeitet die Warteschlange ab; wartet auf neue Aufträge, wenn sie leer ist."""
+    while True:
+        job = db.claim_next_transcription_job()
+        if job is None:
+            job_available.wait(timeout=5)
+            job_available.clear()
+            continue
+        run_transcription_job(job)
+
+
+def start_transcription_workers():
+    """Startet einmal pro Prozess TRANSCRIPTION_JOB_WORKERS Hintergrund-Threads für die Warteschlange."""
+    with registry_lock:
+        if job_workers:
+            return
+        db.setup_transcription_jobs()
+        db.requeue_running_transcription_jobs()
+        for index in range(TRANSCRIPTION_JOB_WORKERS):
+            worker = threading.Thread(target=transcription_worker, name=f"transcription-worker-{index}", daemon=True)
+            worker.start()
+            job_workers.append(worker)
+
+
+def submit_transcription_job(owner, file_name, file_path, model_size=WHISPER_MODEL_SIZE, compute_type=WHISPER_COMPUTE_TYPE):
+    """Reiht eine Audiodatei zur Transkription ein und weckt einen wartenden Worker."""
+    start_transcription_workers()
+    job_id = db.create_transcription_job(owner, file_name, file_path, model_size, compute_type)
+    job_available.set()
+    return job_id
+
+
+def delete_transcription_job(job_id, owner):
+    """Entfernt einen abgeschlossenen Auftrag samt Transkript und hochgeladener Datei."""
+    file_path = db.delete_transcription_job(job_id, owner)
+    if file_path:
+        remove_file(file_path)
+
+
+def format_transcript(segments, with_timestamps=False):
+    """Setzt die Segmente zu einem Text zusammen, optional mit Zeitstempeln."""
+    if with_timestamps:
+        return "\n".join(f"[{format_timestamp(s['start'])} - {format_timestamp(s['end'])}] {s['text']}" for s in segments)
+    return "\n".join(segment["text"] for segment in segments)
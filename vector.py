@@ -1,25 +1,94 @@
+import copy
 import os
 from openai import OpenAI
 from dotenv import load_dotenv
-import tiktoken
-import fitz
 import numpy as np
 import chromadb
 import re
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
 import hashlib
-import chromadb.utils.embedding_functions as embedding_functions
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from embedding_cache import EmbeddingCache
+from lexical_index import LexicalIndex
+from pdf_pipeline import get_encoding
 
 load_dotenv()
 
-chroma_client = chromadb.EphemeralClient()
+# Ein persistenter Vektorspeicher pro Prozess, den sich alle Seiten und Sessions teilen
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_db")
+chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+# Der lexikalische Index liegt neben den Chroma-Daten und wird mit ihnen persistiert
+lexical_index = LexicalIndex(os.path.join(CHROMA_PATH, "lexical_index.sqlite3"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Obergrenzen für einen einzelnen Embedding-Request (OpenAI erlaubt max. 2048 Eingaben pro Request)
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 50000))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 256))
+# Anzahl gleichzeitig laufender Embedding-Requests
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+# Token-Budget pro Minute für alle Sessions zusammen (0 = unbegrenzt)
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 1000000))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+# Faktor, um den der Kandidatenpool der Vektorsuche vor dem Reranking vergrößert wird
+RERANK_CANDIDATE_FACTOR = int(os.getenv("RERANK_CANDIDATE_FACTOR", 4))
+# Konstante k der Reciprocal-Rank-Fusion
+RRF_K = 60
+# Anzahl zwischengespeicherter Abfrageergebnisse (über alle Collections)
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 256))
+# Abfragen mit Paragraphen-Verweisen oder Zitaten in Anführungszeichen gelten als exakte Suche
+EXACT_QUERY_PATTERN = re.compile(r'§\s*\d+|"[^"]+"|„[^“”]+[“”]')
+
 openai_client = OpenAI()
 
+
+class TokenRateLimiter:
+    """Begrenzt den Token-Verbrauch auf ein Budget pro Minute (gleitendes Fenster)."""
+
+    def __init__(self, tokens_per_minute):
+        self.tokens_per_minute = tokens_per_minute
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._used = 0
+
+    def acquire(self, tokens):
+        """Blockiert, bis die angegebene Anzahl Tokens im aktuellen Fenster verfügbar ist."""
+        if self.tokens_per_minute <= 0:
+            return
+        # Ein einzelner Batch darf nie größer sein als das gesamte Budget
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= 60:
+                    _, expired = self._events.popleft()
+                    self._used -= expired
+                if self._used + tokens <= self.tokens_per_minute:
+                    self._events.append((now, tokens))
+                    self._used += tokens
+                    return
+                wait_seconds = 60 - (now - self._events[0][0])
+            time.sleep(wait_seconds)
+
+
+# Prozessweites Limit, damit sich alle Sessions dasselbe Budget teilen
+embedding_rate_limiter = TokenRateLimiter(EMBEDDING_TOKENS_PER_MINUTE)
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+
+# Registry der Collection-Handles und Abfrage-Cache, gemeinsam für alle Sessions
+registry_lock = threading.Lock()
+collection_handles = {}
+collection_names = None
+collection_versions = {}
+query_cache = OrderedDict()
+
+
 def clean_text(text):
     # Konvertierung in Kleinbuchstaben
     text = text.lower()
@@ -37,99 +106,242 @@ def generate_user_hash(request):
     return hashlib.sha256(hash_input.encode()).hexdigest()
 
 def hash_file_content(content):
-    """Erzeugt einen SHA-256 Hash des Inhalts."""
-    return hashlib.sha256(content.encode()).hexdigest()
+    """Erzeugt einen SHA-256 Hash des Inhalts (Text oder Bytes)."""
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def create_embeddings(texts, rate_limiter=None):
+    """
+    Erzeugt Embeddings für mehrere Texte mit einem einzigen Request an OpenAI's API.
+    Die Texte werden unverändert eingebettet (Chunks bereinigt der Aufrufer vorher mit clean_text) und
+    zuerst im Embedding-Cache gesucht, nur fehlende gehen ans Netzwerk.
+    :param rate_limiter: Optionaler TokenRateLimiter, dem nur die Tokens der fehlenden Texte angerechnet werden.
+    """
+    if any(not text.strip() for text in texts):
+        # Leere Eingaben werden von der Embedding-API abgelehnt
+        raise ValueError("Leere Texte können nicht eingebettet werden.")
+    embeddings = embedding_cache.get_many(EMBEDDING_MODEL, texts)
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    if missing:
+        if rate_limiter is not None:
+            rate_limiter.acquire(sum(count_tokens(text) for text in missing))
+        response = openai_client.embeddings.create(
+            input=missing,
+            model=EMBEDDING_MODEL
+        )
+        # Die API liefert einen Index pro Eingabe, darüber wird die Reihenfolge sichergestellt
+        fresh = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        embedding_cache.put_many(EMBEDDING_MODEL, missing, fresh)
+        fresh_by_text = dict(zip(missing, fresh))
+        embeddings = [embedding if embedding is not None else fresh_by_text[text]
+                      for text, embedding in zip(texts, embeddings)]
+    return embeddings
 
 
 def create_embedding(text):
     """Erzeugt einen Text-Embedding mit OpenAI's API."""
-    response = openai_client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    embedding_vector = response.data[0].embedding
-    return embedding_vector
+    return create_embeddings([text])[0]
 
 
-def extract_text_from_pdf(pdf_file):
-    """Extrahiert Text aus einer PDF-Datei."""
-    text = ""
-    with fitz.open(stream=pdf_file.getvalue()) as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+def batch_chunks_by_tokens(records, max_tokens_per_batch=EMBEDDING_BATCH_MAX_TOKENS, max_batch_size=EMBEDDING_BATCH_MAX_SIZE):
+    """
+    Fasst Chunk-Datensätze zu Batches zusammen, die das Token-Limit eines Requests einhalten.
+    Liefert Tupel aus (Batch, Tokenanzahl des Batches).
+    """
+    batch = []
+    batch_tokens = 0
+    for record in records:
+        tokens = count_tokens(record["document"])
+        if batch and (batch_tokens + tokens > max_tokens_per_batch or len(batch) >= max_batch_size):
+            yield batch, batch_tokens
+            batch = []
+            batch_tokens = 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        yield batch, batch_tokens
+
+
+def embed_batches(batches, embed_fn=None, max_concurrency=EMBEDDING_MAX_CONCURRENCY, rate_limiter=None):
+    """
+    Erzeugt die Embeddings für mehrere Batches parallel.
+    Es laufen höchstens max_concurrency Requests gleichzeitig, die Batches werden erst bei Bedarf
+    aus dem Generator gelesen. Liefert Tupel aus (Batch, Embeddings) in der Reihenfolge der Fertigstellung.
+    Mit create_embeddings werden dem Rate-Limiter nur die Tokens angerechnet, die nicht im Cache liegen;
+    eine eigene embed_fn hat keinen Cache und wird mit allen Tokens des Batches angerechnet.
+    :param embed_fn: Funktion, die eine Liste von Texten in eine Liste von Vektoren umwandelt (z.B. ein lokaler Stub).
+    """
+    rate_limiter = rate_limiter or embedding_rate_limiter
+
+    def embed(batch, batch_tokens):
+        texts = [record["document"] for record in batch]
+        if embed_fn is None:
+            return batch, create_embeddings(texts, rate_limiter)
+        rate_limiter.acquire(batch_tokens)
+        return batch, embed_fn(texts)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = set()
+        for batch, batch_tokens in batches:
+            if len(pending) >= max_concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(executor.submit(embed, batch, batch_tokens))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
 
 def count_tokens(text):
     """Zählt die Anzahl der Tokens in einem Text."""
-    encoding = tiktoken.encoding_for_model("gpt-4-0125-preview")
-    tokens = encoding.encode(text)
+    tokens = get_encoding().encode(text)
     return len(tokens)
 
-def convert_pdf_to_string(file_bytes):
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    text = ''
-    for page in doc:
-        text += page.get_text()
-    return text
 
+def normalize_vectors(vectors):
+    """Normiert Vektoren (zeilenweise) auf die Länge 1, damit das Skalarprodukt der Kosinusähnlichkeit entspricht."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
 
-def rerank_results(results, query):
+
+def rerank_results(results, query_embedding=None, top_k=None):
     """
-    Rerankt die Ergebnisse basierend auf zusätzlichen Relevanzmetriken.
+    Rerankt die Ergebnisse einer Abfrage nach Kosinusähnlichkeit zum Abfrage-Embedding.
+    Alle Kandidaten werden mit einer Matrixmultiplikation bewertet, die besten top_k per
+    Teilauswahl (argpartition) bestimmt. Ohne query_embedding wird das in den Ergebnissen
+    mitgelieferte Embedding von query_collection verwendet, es entsteht also kein neuer Request.
+    :return: Ergebnisse im Format von query_collection, zusätzlich mit "scores".
     """
-    query_embedding = create_embedding(query)
-
-    # Berechne die Ähnlichkeit jedes Ergebnisses mit der Abfrage
-    ranked_results = sorted(
-        results,
-        key=lambda x: cosine_similarity(query_embedding, x['embedding']),
-        reverse=True  # Höhere Ähnlichkeit bedeutet höhere Relevanz
+    if query_embedding is None:
+        query_embedding = results["query_embeddings"][0]
+    candidates = results.get("embeddings")
+    if not candidates or not len(candidates[0]):
+        return results
+
+    # Gespeicherte Vektoren sind bereits normiert, siehe upsert_batch
+    scores = np.asarray(candidates[0], dtype=np.float32) @ normalize_vectors(query_embedding)
+    top_k = len(scores) if top_k is None else min(top_k, len(scores))
+    if top_k < len(scores):
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    # Nur die ausgewählten Kandidaten werden noch sortiert
+    order = top[np.argsort(-scores[top])]
+
+    reranked = {"scores": [scores[order].tolist()]}
+    for key in ("ids", "documents", "metadatas", "distances", "embeddings"):
+        if results.get(key) is not None and results[key][0] is not None:
+            values = results[key][0]
+            reranked[key] = [[values[i] for i in order]]
+    if "query_embeddings" in results:
+        reranked["query_embeddings"] = results["query_embeddings"]
+    return reranked
+
+
+def upsert_batch(collection, batch, embeddings):
+    """Schreibt einen kompletten Batch mit einem einzigen Upsert in die Collection."""
+    collection.upsert(
+        # Normiert speichern, damit das Reranking mit reinen Skalarprodukten auskommt
+        embeddings=normalize_vectors(embeddings).tolist(),
+        documents=[record["document"] for record in batch],
+        metadatas=[record["metadata"] for record in batch],
+        ids=[record["id"] for record in batch]
     )
-    return ranked_results
-
+    lexical_index.add(collection.name, [record["id"] for record in batch], [record["document"] for record in batch])
+    invalidate_collection(collection.name)
 
-def cosine_similarity(vec1, vec2):
-    """Berechnet die Kosinusähnlichkeit zwischen zwei Vektoren."""
-    dot_product = np.dot(vec1, vec2)
-    norm_a = np.linalg.norm(vec1)
-    norm_b = np.linalg.norm(vec2)
-    return dot_product / (norm_a * norm_b)
 
-
-def tokenize_and_chunk_text(text, max_tokens_per_chunk):
+def make_chunk_id(document_name, chunk_text, occurrence):
     """
-    Zerlegt den Text in Chunks, basierend auf der maximalen Anzahl von Tokens pro Chunk.
+    Erzeugt eine stabile Chunk-ID aus Dokumentname und Chunk-Inhalt.
+    occurrence unterscheidet identische Chunks innerhalb desselben Dokuments.
     """
-    encoding = tiktoken.encoding_for_model("gpt-4-0125-preview")
-    tokens = encoding.encode(text)
-
-    # Aufteilen der Token-Liste in Chunks
-    chunks = [tokens[i:i + max_tokens_per_chunk] for i in range(0, len(tokens), max_tokens_per_chunk)]
+    digest = hashlib.sha256(f"{document_name}\0{chunk_text}".encode()).hexdigest()[:32]
+    return f"{digest}_{occurrence}"
 
-    # Konvertiere die Chunks von Token-Integers zurück in String-Form
-    text_chunks = [encoding.decode(chunk) for chunk in chunks]
 
-    return text_chunks
+def count_indexed_chunks(collection, hash_value, max_tokens_per_chunk):
+    """
+    Zählt die Chunks, die für einen Inhalts-Hash mit gleicher Chunk-Size bereits in der Collection liegen.
+    Bei einem Wert größer 0 ist das Dokument unverändert und muss nicht erneut verarbeitet werden.
+    """
+    indexed = collection.get(
+        where={"$and": [{"hash": hash_value}, {"chunk_size": max_tokens_per_chunk}]},
+        include=["metadatas"]
+    )
+    return len(indexed["ids"])
 
 
-def add_document_to_collection(collection ,text, doc_id, hash_value, max_tokens_per_chunk, collection_description):
+def add_document_to_collection(collection, chunks, document_name, hash_value, max_tokens_per_chunk, collection_description, embed_fn=None, indexed_chunks=None):
     """
     Erweiterte Funktion zum Hinzufügen eines Dokuments in Chunks zur Collection.
+    chunks ist ein (gerne lazy erzeugter) Strom von Dictionaries aus iter_token_chunks.
+    Dokumente werden über ihren Inhalts-Hash erkannt: unveränderte Dokumente werden übersprungen,
+    bei überarbeiteten Dokumenten werden nur geänderte Chunks neu eingebettet und verwaiste Chunks gelöscht.
+    Die Chunks werden in Token-begrenzten Batches parallel eingebettet und pro Batch mit einem Upsert gespeichert.
+    :param indexed_chunks: Ergebnis von count_indexed_chunks, falls der Aufrufer es bereits ermittelt hat.
+    :return: Dictionary mit Status und der Anzahl eingebetteter, wiederverwendeter und gelöschter Chunks.
     """
-    # Zuerst teilen wir den Text in Chunks.
-    text_chunks = tokenize_and_chunk_text(text, max_tokens_per_chunk)
-
-    # Für jeden Chunk fügen wir ihn zur Collection hinzu.
-    for i, chunk in enumerate(text_chunks):
-        clean_chunk = clean_text(chunk)
-        embedding = create_embedding(clean_chunk)
-        chunk_id = f"{doc_id}_{i}"  # Erzeuge eine eindeutige ID für jeden Chunk basierend auf der doc_id und der Reihenfolge.
-        collection.upsert(
-            embeddings=[embedding],
-            documents=[clean_chunk],
-            metadatas=[{"source": "user_uploaded_pdf", "hash": hash_value, "describtion": collection_description, "chunk_id": chunk_id}],
-            ids=[chunk_id]
-        )
+    if indexed_chunks is None:
+        indexed_chunks = count_indexed_chunks(collection, hash_value, max_tokens_per_chunk)
+    if indexed_chunks:
+        return {"status": "unchanged", "embedded": 0, "reused": indexed_chunks, "deleted": 0}
+
+    existing_ids = set(collection.get(where={"document": document_name}, include=["metadatas"])["ids"])
+    seen_ids = set()
+    kept_ids = []
+    kept_metadatas = []
+
+    def records():
+        occurrences = {}
+        for i, chunk in enumerate(chunks):
+            clean_chunk = clean_text(chunk["text"])
+            if not clean_chunk:
+                # Leere Eingaben werden von der Embedding-API abgelehnt
+                continue
+            occurrence = occurrences.get(clean_chunk, 0)
+            occurrences[clean_chunk] = occurrence + 1
+            chunk_id = make_chunk_id(document_name, clean_chunk, occurrence)
+            seen_ids.add(chunk_id)
+            metadata = {"source": "user_uploaded_pdf", "document": document_name, "hash": hash_value,
+                        "chunk_size": max_tokens_per_chunk, "describtion": collection_description,
+                        "chunk_id": chunk_id, "chunk_index": i,
+                        "page_start": chunk["page_start"], "page_end": chunk["page_end"]}
+            if chunk_id in existing_ids:
+                # Unveränderter Chunk: Embedding behalten, nur die Metadaten aktualisieren
+                kept_ids.append(chunk_id)
+                kept_metadatas.append(metadata)
+                continue
+            yield {"id": chunk_id, "document": clean_chunk, "metadata": metadata}
+
+    embedded_chunks = 0
+    for batch, embeddings in embed_batches(batch_chunks_by_tokens(records()), embed_fn=embed_fn):
+        upsert_batch(collection, batch, embeddings)
+        embedded_chunks += len(batch)
+
+    for start in range(0, len(kept_ids), EMBEDDING_BATCH_MAX_SIZE):
+        collection.update(ids=kept_ids[start:start + EMBEDDING_BATCH_MAX_SIZE],
+                          metadatas=kept_metadatas[start:start + EMBEDDING_BATCH_MAX_SIZE])
+    if kept_ids:
+        invalidate_collection(collection.name)
+
+    orphaned_ids = list(existing_ids - seen_ids)
+    if orphaned_ids:
+        collection.delete(ids=orphaned_ids)
+        lexical_index.remove(collection.name, orphaned_ids)
+        invalidate_collection(collection.name)
+
+    return {
+        "status": "updated" if existing_ids else "new",
+        "embedded": embedded_chunks,
+        "reused": len(kept_ids),
+        "deleted": len(orphaned_ids),
+    }
 
 
 def clean_collection_name(name):
@@ -152,31 +364,155 @@ def clean_collection_name(name):
     return cleaned_name
 
 
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Embedding-Funktion für ChromaDB, die über den Embedding-Cache läuft."""
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return create_embeddings(input)
+
+
+embedding_function = CachedEmbeddingFunction()
+
+
+def invalidate_collection(collection_name):
+    """Erhöht den Versionszähler einer Collection, zwischengespeicherte Abfragen werden damit ungültig."""
+    with registry_lock:
+        collection_versions[collection_name] = collection_versions.get(collection_name, 0) + 1
+
+
+def get_collection_version(collection_name):
+    """Gibt den aktuellen Versionszähler einer Collection zurück."""
+    with registry_lock:
+        return collection_versions.get(collection_name, 0)
+
+
+def get_collection(collection_name):
+    """Gibt den zwischengespeicherten Handle einer bestehenden Collection zurück."""
+    with registry_lock:
+        collection = collection_handles.get(collection_name)
+        if collection is None:
+            collection = chroma_client.get_collection(name=collection_name, embedding_function=embedding_function)
+            collection_handles[collection_name] = collection
+        return collection
+
+
+def get_or_create_collection(collection_name):
+    """Gibt die Collection zurück und legt sie bei Bedarf im gemeinsamen Vektorspeicher an."""
+    global collection_names
+    with registry_lock:
+        collection = collection_handles.get(collection_name)
+        if collection is None:
+            collection = chroma_client.get_or_create_collection(name=collection_name, embedding_function=embedding_function)
+            collection_handles[collection_name] = collection
+            collection_names = None
+        return collection
+
+
+def delete_collection(collection_name):
+    """Löscht eine Collection aus dem gemeinsamen Vektorspeicher."""
+    global collection_names
+    with registry_lock:
+        chroma_client.delete_collection(name=collection_name)
+        collection_handles.pop(collection_name, None)
+        collection_names = None
+    lexical_index.drop(collection_name)
+    invalidate_collection(collection_name)
+
+
 def list_collections():
     """Listet alle Collections auf (angepasst für deine ChromaDB-Implementierung)."""
-    collections = chroma_client.list_collections()
-    return [collection.name for collection in collections]
+    global collection_names
+    with registry_lock:
+        if collection_names is None:
+            collection_names = [collection.name for collection in chroma_client.list_collections()]
+        return list(collection_names)
 
 def collection_exists(collection_name):
     """Überprüft, ob eine bestimmte Collection existiert."""
     existing_collections = list_collections()
     return collection_name in existing_collections
 
+def ensure_lexical_index(collection):
+    """Baut den lexikalischen Index einmalig nach, falls die Collection vor dessen Einführung befüllt wurde."""
+    if lexical_index.size(collection.name) == 0 and collection.count() > 0:
+        existing = collection.get(include=["documents"])
+        lexical_index.add(collection.name, existing["ids"], existing["documents"])
+
+
+def fuse_rankings(rankings, number_of_results, k=RRF_K):
+    """Führt mehrere Ranglisten von Chunk-IDs per Reciprocal-Rank-Fusion zusammen."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:number_of_results]
+
+
 def query_collection(query, collection_name, number_of_results=3):
-    """Führt eine Abfrage auf der angegebenen Collection durch."""
-    openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=OPENAI_API_KEY,
-        model_name="text-embedding-3-small"
-    )
+    """
+    Führt eine hybride Abfrage (Vektorsuche und BM25) auf der angegebenen Collection durch.
+    Die Vektorsuche liefert einen größeren Kandidatenpool, der anschließend exakt gereranked wird,
+    beide Ranglisten werden per Reciprocal-Rank-Fusion zusammengeführt. Exakte Abfragen
+    (Paragraphen, Zitate) mit lexikalischen Treffern kommen ohne Embedding-Request aus.
+    Ergebnisse werden pro Collection-Version zwischengespeichert, jede Änderung an der Collection
+    macht sie ungültig. Aufrufer erhalten immer eine eigene Kopie, der Cache-Eintrag bleibt unverändert.
+    """
+    if not query.strip():
+        return {"ids": [[]], "documents": [[]], "metadatas": [[]]}
+
+    with registry_lock:
+        cache_key = (collection_name, collection_versions.get(collection_name, 0), query, number_of_results)
+        if cache_key in query_cache:
+            query_cache.move_to_end(cache_key)
+            return copy.deepcopy(query_cache[cache_key])
 
     try:
-        collection = chroma_client.get_collection(name=collection_name, embedding_function=openai_ef)
-        results = collection.query(
-            query_texts=[query],
-            n_results=number_of_results,
-            include=["embeddings", "documents", "metadatas", "distances"]
-        )
+        collection = get_collection(collection_name)
+        ensure_lexical_index(collection)
+        candidate_count = number_of_results * RERANK_CANDIDATE_FACTOR
+        lexical_ids = [chunk_id for chunk_id, _ in lexical_index.search(collection_name, clean_text(query), candidate_count)]
+
+        if lexical_ids and EXACT_QUERY_PATTERN.search(query):
+            vector_ids = []
+            results = {}
+        else:
+            query_embedding = create_embedding(query)
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=candidate_count,
+                include=["embeddings", "documents", "metadatas", "distances"]
+            )
+            results["query_embeddings"] = [query_embedding]
+            results = rerank_results(results)
+            vector_ids = results["ids"][0]
+
+        fused_ids = fuse_rankings([vector_ids, lexical_ids], number_of_results)
+        documents = {}
+        metadatas = {}
+        if vector_ids:
+            documents.update(zip(vector_ids, results["documents"][0]))
+            metadatas.update(zip(vector_ids, results["metadatas"][0]))
+        missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in documents]
+        if missing_ids:
+            # Rein lexikalische Treffer werden lokal aus Chroma nachgeladen
+            lexical_hits = collection.get(ids=missing_ids, include=["documents", "metadatas"])
+            documents.update(zip(lexical_hits["ids"], lexical_hits["documents"]))
+            metadatas.update(zip(lexical_hits["ids"], lexical_hits["metadatas"]))
+        fused_ids = [chunk_id for chunk_id in fused_ids if chunk_id in documents]
+        fused_results = {
+            "ids": [fused_ids],
+            "documents": [[documents[chunk_id] for chunk_id in fused_ids]],
+            "metadatas": [[metadatas[chunk_id] for chunk_id in fused_ids]],
+        }
+        if "query_embeddings" in results:
+            fused_results["query_embeddings"] = results["query_embeddings"]
+        results = fused_results
+        with registry_lock:
+            query_cache[cache_key] = results
+            while len(query_cache) > QUERY_CACHE_MAX_ENTRIES:
+                query_cache.popitem(last=False)
+        results = copy.deepcopy(results)
     except Exception as e:
         print(f"Ein Fehler ist aufgetreten: {e}")
-        results = {"documents": [""]}
-    return results
\ No newline at end of file
+        results = {"documents": [[]]}
+    return results
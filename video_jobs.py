@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+import traceback
+import requests
+from dotenv import load_dotenv
+import database as db
+
+load_dotenv()
+
+HEYGEN_API_KEY = os.getenv('HEYGEN_API_KEY')
+# Für Tests kann hier ein lokaler Fake-Server eingetragen werden
+HEYGEN_BASE_URL = os.getenv('HEYGEN_BASE_URL', 'https://api.heygen.com').rstrip('/')
+HEYGEN_TIMEOUT = float(os.getenv('HEYGEN_TIMEOUT', 30))
+# Erste Abfrage nach VIDEO_POLL_INITIAL_SECONDS, danach mit doppeltem Abstand bis höchstens VIDEO_POLL_MAX_SECONDS
+VIDEO_POLL_INITIAL_SECONDS = float(os.getenv('VIDEO_POLL_INITIAL_SECONDS', 5))
+VIDEO_POLL_MAX_SECONDS = float(os.getenv('VIDEO_POLL_MAX_SECONDS', 120))
+FINAL_STATUSES = ('completed', 'failed')
+
+# Eine HTTP-Session für alle Anfragen an HeyGen, damit Verbindungen wiederverwendet werden
+session = requests.Session()
+session.headers.update({'X-Api-Key': HEYGEN_API_KEY or ''})
+poller_thread = None
+poller_lock = threading.Lock()
+poll_requested = threading.Event()
+
+
+def get_poll_delay(attempts):
+    """Exponentieller Backoff für die nächste Statusabfrage."""
+    return min(VIDEO_POLL_MAX_SECONDS, VIDEO_POLL_INITIAL_SECONDS * 2 ** attempts)
+
+
+def create_video(text):
+    """Beauftragt ein Video bei HeyGen und gibt die Video-ID zurück (None bei einem Fehler)."""
+    data = {
+      "video_inputs": [
+        {
+          "character": {
+            "type": "avatar",
+            "avatar_id": "Daisy-inskirt-20220818",
+            "avatar_style": "normal"
+          },
+          "voice": {
+            "type": "text",
+            "input_text": text,
+            "voice_id": "2d5b0e6cf36f460aa7fc47e3eee4ba54"
+          },
+          "background": {
+            "type": "color",
+            "value": "#008000"
+          }
+        }
+      ],
+      "dimension": {
+        "width": 1280,
+        "height": 720
+      },
+      "aspect_ratio": "16:9",
+      "test": True
+    }
+
+    try:
+        response = session.post(f'{HEYGEN_BASE_URL}/v2/video/generate', json=data, timeout=HEYGEN_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"HeyGen nicht erreichbar: {e}")
+        return None
+    if response.status_code == 200:
+        return response.json()["data"]["video_id"]
+    print(f"Error: {response.status_code}, {response.text}")
+    return None
+
+
+def get_video_status(video_id):
+    """Fragt den Status eines Videos ab und gibt die Daten der Antwort zurück (None bei einem Fehler)."""
+    try:
+        response = session.get(f'{HEYGEN_BASE_URL}/v1/video_status.get', params={'video_id': video_id},
+                               timeout=HEYGEN_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"HeyGen nicht erreichbar: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Error: {response.status_code}, {response.text}")
+        return None
+    return response.json().get('data', {})
+
+
+def poll_due_videos():
+    """Fragt alle fälligen Videos ab und plant die nächste Abfrage mit Backoff ein."""
+    for job in db.get_due_video_jobs(time.time(), FINAL_STATUSES):
+        payload = get_video_status(job["video_id"])
+        attempts = job["attempts"] + 1
+        # Bei Fehlern der Abfrage bleiben Status und letzte Antwort erhalten, es wird später erneut versucht
+        status = payload.get('status') if payload is not None else None
+        db.update_video_job(job["video_id"], status, payload, attempts, time.time() + get_poll_delay(attempts))
+
+
+def video_poller():
+    """Hintergrund-Thread: fragt fällige Videos ab und schläft bis zur nächsten fälligen Abfrage."""
+    while True:
+        try:
+            poll_due_videos()
+            next_poll_at = db.get_next_video_poll_time(FINAL_STATUSES)
+        except Exception:
+            traceback.print_exc()
+            next_poll_at = None
+        timeout = VIDEO_POLL_MAX_SECONDS if next_poll_at is None else max(0.0, next_poll_at - time.time())
+        poll_requested.wait(timeout=timeout)
+        poll_requested.clear()
+
+
+def start_video_poller():
+    """Startet einmal pro Prozess den Hintergrund-Thread für die Statusabfragen."""
+    global poller_thread
+    with poller_lock:
+        if poller_thread is None:
+            db.setup_video_jobs()
+            poller_thread = threading.Thread(target=video_poller, name="video-poller", daemon=True)
+            poller_thread.start()
+
+
+def submit_video(owner, text, title):
+    """Beauftragt ein Video und übergibt es dem Hintergrund-Thread. Gibt die Video-ID oder None zurück."""
+    start_video_poller()
+    video_id = create_video(text)
+    if video_id:
+        db.create_video_job(video_id, owner, title, time.time() + VIDEO_POLL_INITIAL_SECONDS)
+        poll_requested.set()
+    return video_id